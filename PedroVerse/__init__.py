@@ -1,21 +1,54 @@
 """
 Stylization module exposing core effects: pixelation, brush strokes, and Voronoi stylization.
+
+Effects are loaded lazily: importing the package is cheap and each effect only
+pulls in its own dependencies (torch, pyxelate, skimage, ...) when first used.
 """
+import importlib
+
+
+# Public name -> submodule defining it, resolved on first attribute access.
+_LAZY_ATTRS = {
+    "pixelate": ".geometric_abstruction",
+    "apply_brush_strokes": ".geometric_abstruction",
+    "apply_voronoi": ".geometric_abstruction",
+    "apply_brushstyle": ".geometric_abstruction",
+    "apply_slic": ".geometric_abstruction",
+    "apply_uv_mask_from_arrays": ".utils",
+    "edge_detection": ".utils",
+    "apply_bilateral_filter": ".utils",
+}
+
+# Effect id (as used by run_effect_subprocess.py) -> modules the effect needs.
+EFFECT_MODULES = {
+    "pixelate": (".geometric_abstruction", "pyxelate"),
+    "brush": (".geometric_abstruction", ".neural_paint_transformer.inference"),
+    "voronoi": (".geometric_abstruction", ".water_color"),
+    "brushstyle": (".geometric_abstruction", ".painterlybrush"),
+    "slicstylize": (".geometric_abstruction", "skimage.segmentation", "skimage.util"),
+    # texture_transfer/ sits next to PedroVerse, on the path of the worker and the benchmark.
+    # The TFLite runtime itself is picked when the first interpreter is created.
+    "texture": (".tflite_backend", "texture_transfer.texture_subprocess"),
+}
+
+__all__ = list(_LAZY_ATTRS) + ["EFFECT_MODULES", "load_effect"]
 
 
+def load_effect(effect_id):
+    """Imports every dependency of `effect_id` up front, e.g. to warm up a worker."""
+    if effect_id not in EFFECT_MODULES:
+        raise ValueError(f"Unknown effect '{effect_id}'. Valid options are: {list(EFFECT_MODULES.keys())}")
+    for module in EFFECT_MODULES[effect_id]:
+        importlib.import_module(module, __name__)
 
 
-from .geometric_abstruction import (
-    pixelate,
-    apply_brush_strokes,
-    apply_voronoi,
-    apply_brushstyle,
-    apply_slic
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        value = getattr(importlib.import_module(_LAZY_ATTRS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-)
 
-from .utils import (
-    apply_uv_mask_from_arrays,
-    edge_detection,
-    apply_bilateral_filter
-)
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRS))
@@ -0,0 +1,42 @@
+"""
+Size bound for the on-disk caches (Voronoi pattern bank, style bottlenecks,
+Paint Transformer strokes).
+
+Cache hits refresh the file's mtime (`touch`), so the mtime is the last use and
+`evict` can drop the least recently used entries first.
+"""
+import os
+
+
+def touch(path):
+    """Marks a cache entry as recently used."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def evict(cache_dir, max_bytes, keep=None, suffix=".npy"):
+    """Deletes the least recently used `suffix` files until cache_dir fits in max_bytes."""
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(suffix):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass  # e.g. still mapped by another process on Windows
@@ -1,20 +1,10 @@
 import cv2
 import numpy as np
-import subprocess
-
-import torch
-import torch.nn.functional as F
 import os
-import math
-import pyxelate
-from pyxelate import Pyx, Pal
-from .painterlybrush import painterlybrush
-from skimage.segmentation import slic
-from skimage.util import img_as_float
-
 
-from .neural_paint_transformer.inference import execute_paint_transformer
-from .water_color import generate_water_color
+# Heavy dependencies (torch, pyxelate, skimage, the paint transformer) are
+# imported inside the effect that needs them, so using one effect does not
+# pay the import cost of all the others.
 
 
 BASE_MODEL_DIR = os.path.join(os.path.dirname(__file__), "model_weights")
@@ -30,6 +20,8 @@ def pixelate(image_bgr, downsample_ratio=4, palette=7):
     downsample_by = downsample_ratio  # new image will be 1/14th of the original in size
     palette = palette  # find 7 colors
 
+    from pyxelate import Pyx
+
     # 1) Instantiate Pyx transformer
     pyx = Pyx(factor=downsample_by, palette=palette)
 
@@ -44,7 +36,7 @@ def pixelate(image_bgr, downsample_ratio=4, palette=7):
 
 
 
-def apply_brush_strokes(image_bgr, vertical_brush , horizontal_brush , model_path=PAINTER_MODEL_PATH):
+def apply_brush_strokes(image_bgr, vertical_brush , horizontal_brush , model_path=PAINTER_MODEL_PATH, memory_budget_mb=None, max_layer=None, cache_strokes=False):
     """
     Applies a painterly brush stroke effect to simulate hand-painted strokes.
 
@@ -52,11 +44,18 @@ def apply_brush_strokes(image_bgr, vertical_brush , horizontal_brush , model_pat
     - image_bgr: Input image in BGR format.
     - stroke_width: Width of the simulated brush strokes.
     - orientation: Direction of strokes; 'random', 'horizontal', or 'vertical'.
+    - memory_budget_mb: Approximate memory limit for rendering; patches are then processed
+      in chunks (same result). None renders every layer at once.
+    - max_layer: Stop after this pyramid layer (0 = coarsest) for a quick preview.
+    - cache_strokes: Reuse the strokes predicted for this image before and only redraw
+      them with the given brushes.
 
     Returns:
     - Image with a brush stroke style overlay.
     """
-    output = execute_paint_transformer(image_bgr, vertical_brush=vertical_brush, horizontal_brush=horizontal_brush , model_path=model_path , output_dir=None)
+    from .neural_paint_transformer.inference import execute_paint_transformer
+
+    output = execute_paint_transformer(image_bgr, vertical_brush=vertical_brush, horizontal_brush=horizontal_brush , model_path=model_path , output_dir=None, memory_budget_mb=memory_budget_mb, max_layer=max_layer, cache_strokes=cache_strokes)
     return output
 
 
@@ -66,23 +65,39 @@ def apply_voronoi(img,
     num_voronoi_patterns=3,
     oil_paint_size=12,
     oil_paint_dyn_ratio=10,
-    use_bilateral_filter=True,):
+    use_bilateral_filter=True,
+    seed=None,
+    use_pattern_bank=False,
+    smoothing_scale=1.0,
+    upsample_mode="bilinear",):
     """
     Generates a Voronoi-style mosaic effect based on color clustering.
     
     Parameters:
     - image_bgr: Input image in BGR format.
     - cell_count: Approximate number of Voronoi regions.
+    - seed: Seed for the Voronoi patterns, for reproducible results.
+    - use_pattern_bank: Reuse cached Voronoi patterns instead of generating new ones.
+    - smoothing_scale: Run the bilateral and oil painting stages at this fraction of
+      the resolution (1.0 = full quality, 0.5 / 0.25 = faster; see
+      benchmarks/watercolor_smoothing.py).
+    - upsample_mode: "bilinear" or "guided" upsampling of the smoothed image.
 
     Returns:
     - Image stylized with Voronoi tessellation.
     """
+    from .water_color import generate_water_color
+
     output  = generate_water_color(
         img,
         num_voronoi_patterns=num_voronoi_patterns,
         oil_paint_size=oil_paint_size,
         oil_paint_dyn_ratio=oil_paint_dyn_ratio,
         use_bilateral_filter=use_bilateral_filter,
+        seed=seed,
+        use_pattern_bank=use_pattern_bank,
+        smoothing_scale=smoothing_scale,
+        upsample_mode=upsample_mode,
     )
     return output
 
@@ -101,7 +116,14 @@ STYLE_MAP = {
     "--pointillist": POINTILLIST
 }
 
-def apply_brushstyle(img_path, output_path=None, style_flag="--expressionist"):
+def apply_brushstyle(img_path, output_path=None, style_flag="--expressionist", seed=None, compact=False,
+                     tile_size=None, workers=None):
+    """
+    Paints the image at img_path in one of the STYLE_MAP presets.
+
+    With tile_size set, images larger than tile_size are painted in overlapping
+    tiles on a pool of `workers` processes (all CPUs by default) and blended.
+    """
     if style_flag not in STYLE_MAP:
         raise ValueError(f"Unknown style_flag '{style_flag}'. Valid options are: {list(STYLE_MAP.keys())}")
 
@@ -110,8 +132,13 @@ def apply_brushstyle(img_path, output_path=None, style_flag="--expressionist"):
     if source_img is None:
         raise FileNotFoundError(f"Image not found at: {img_path}")
 
-    painter = painterlybrush()
-    result = painter.paint(source_img, *params)
+    from .painterlybrush import painterlybrush, paintTiled
+
+    if tile_size and max(source_img.shape[:2]) > tile_size:
+        result = paintTiled(source_img, params, tileSize=tile_size, workers=workers, seed=seed, compact=compact)
+    else:
+        painter = painterlybrush()
+        result = painter.paint(source_img, *params, seed=seed, compact=compact)
 
     if output_path:
         cv2.imwrite(output_path, result)
@@ -119,27 +146,50 @@ def apply_brushstyle(img_path, output_path=None, style_flag="--expressionist"):
     return result
 
 
-def stylize_normals_with_slic(normal_map, num_segments=300, compactness=50):
-    # Convert image to float and run SLIC
-    normal_float = img_as_float(normal_map)
-    segments = slic(normal_float, n_segments=num_segments, compactness=compactness, start_label=1)
+def slic_segments(image_float, num_segments=300, compactness=50, max_side=None):
+    """
+    Runs SLIC on image_float. With max_side set, larger images are segmented on a
+    copy downscaled to max_side on their longest side and the labels are
+    upsampled back (nearest neighbour) to full resolution.
+    """
+    from skimage.segmentation import slic
+
+    h, w = image_float.shape[:2]
+    scale = max_side / max(h, w) if max_side else 1.0
+    if scale >= 1.0:
+        return slic(image_float, n_segments=num_segments, compactness=compactness, start_label=1)
 
-    # Output image initialized
-    output = np.zeros_like(normal_float)
+    small_size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    small = cv2.resize(image_float, small_size, interpolation=cv2.INTER_AREA)
+    segments = slic(small, n_segments=num_segments, compactness=compactness, start_label=1)
 
-    # Stylize each superpixel by averaging
-    for label in np.unique(segments):
-        mask = segments == label
-        for c in range(3):  # R, G, B
-            avg_val = np.mean(normal_float[:, :, c][mask])
-            output[:, :, c][mask] = avg_val
+    rows = np.arange(h) * segments.shape[0] // h
+    cols = np.arange(w) * segments.shape[1] // w
+    return segments[rows[:, None], cols[None, :]]
+
+def stylize_normals_with_slic(normal_map, num_segments=300, compactness=50, max_side=None):
+    from skimage.util import img_as_float
+
+    # Convert image to float and run SLIC
+    normal_float = img_as_float(normal_map)
+    segments = slic_segments(normal_float, num_segments=num_segments, compactness=compactness, max_side=max_side)
+
+    # Stylize each superpixel by averaging: per-label sums in one pass, then a
+    # single gather writes every pixel's segment mean
+    labels = segments.ravel()
+    pixels = normal_float.reshape(-1, normal_float.shape[-1])
+    counts = np.bincount(labels)
+    means = np.stack([np.bincount(labels, weights=pixels[:, c], minlength=len(counts))
+                      for c in range(pixels.shape[-1])], axis=-1)
+    means /= np.maximum(counts, 1)[:, None]
+    output = means[segments]
 
     return (output * 255).astype(np.uint8)
 
-def apply_slic(img, num_segments=300, compactness=50):
+def apply_slic(img, num_segments=300, compactness=50, max_side=None):
 
 
     img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    stylized = stylize_normals_with_slic(img_rgb, num_segments=num_segments, compactness=compactness)
+    stylized = stylize_normals_with_slic(img_rgb, num_segments=num_segments, compactness=compactness, max_side=max_side)
     return stylized
     
\ No newline at end of file
@@ -4,17 +4,132 @@ import numpy as np
 from PIL import Image
 from . import network
 from . import morphology
+from ..disk_cache import evict, touch
 import os
 import math
+import hashlib
+from collections import OrderedDict
 
 idx = 0
 
+PATCH_SIZE = 32
+STROKE_NUM = 8
+
+# Resized meta brushes larger than this (H * W) are not kept in the cache;
+# the coarsest layers render huge patches that would pin hundreds of MB.
+MAX_CACHED_BRUSH_PIXELS = 512 * 512
+
+# Brush pairs a session keeps preprocessed; the least recently used pair is dropped.
+MAX_CACHED_BRUSH_PAIRS = 4
+
+# Approximate peak memory used per patch when running net_g, and per rendered
+# stroke pixel and channel in param2stroke (brush, grid, color map, foreground,
+# alpha and the morphology outputs), used to size chunks for a memory budget.
+NET_BYTES_PER_PATCH = 3 * 2 ** 19
+RENDER_BYTES_PER_VALUE = 4 * 9
+
+# net_g is only bit-identical across batch sizes when no batch is tiny: small
+# batches take different BLAS code paths that round differently.
+MIN_NET_CHUNK = 64
+
 
 def save_img(img, output_path):
     result = Image.fromarray((img.data.cpu().numpy().transpose((1, 2, 0)) * 255).astype(np.uint8))
     result.save(output_path)
 
 
+class MetaBrushes:
+    """
+    Vertical and horizontal meta brushes (2 x 3 x brush_h x brush_w) together with
+    their copies resized to each render size, so param2stroke does not re-interpolate
+    the brushes for every batch of strokes.
+    """
+
+    def __init__(self, brushes):
+        self.brushes = brushes
+        self._resized = {}
+
+    def resize(self, H, W):
+        if (H, W) in self._resized:
+            return self._resized[(H, W)]
+        resized = F.interpolate(self.brushes, (H, W))
+        if H * W <= MAX_CACHED_BRUSH_PIXELS:
+            self._resized[(H, W)] = resized
+        return resized
+
+
+def load_painter(model_path, device, mmap=False):
+    """
+    Builds the Painter network and loads its weights once.
+    Uses `weights_only` loading (and optionally memory-mapping) when torch supports it.
+    """
+    net_g = network.Painter(5, STROKE_NUM, 256, 8, 3, 3)
+    try:
+        state_dict = torch.load(model_path, map_location='cpu', weights_only=True, mmap=mmap)
+    except TypeError:
+        # Older torch without weights_only / mmap.
+        state_dict = torch.load(model_path, map_location='cpu')
+    net_g.load_state_dict(state_dict)
+    net_g = net_g.to(device)
+    net_g.eval()
+    for param in net_g.parameters():
+        param.requires_grad = False
+    return net_g
+
+
+def brush_hash(brush):
+    brush = np.ascontiguousarray(np.asarray(brush))
+    digest = hashlib.sha1(brush.tobytes())
+    digest.update(str((brush.shape, brush.dtype.str)).encode())
+    return digest.hexdigest()
+
+
+def make_meta_brushes(vertical_brush, horizontal_brush, device):
+    brush_large_horizontal = preprocess_img(vertical_brush, 'L').to(device)
+    brush_large_vertical = preprocess_img(horizontal_brush, 'L').to(device)
+    return MetaBrushes(torch.cat([brush_large_vertical, brush_large_horizontal], dim=0))
+
+
+class PaintTransformerSession:
+    """
+    A loaded Paint Transformer model plus its preprocessed meta brushes.
+    Create it once (see get_session) and reuse it across jobs in a warm worker:
+    the weights are loaded a single time and the last MAX_CACHED_BRUSH_PAIRS brush
+    pairs are cached by content hash.
+    """
+
+    def __init__(self, model_path, device=None, mmap=False):
+        self.model_path = model_path
+        self.device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.net_g = load_painter(model_path, self.device, mmap=mmap)
+        self._brushes = OrderedDict()
+
+    def meta_brushes(self, vertical_brush, horizontal_brush):
+        key = (brush_hash(vertical_brush), brush_hash(horizontal_brush))
+        if key in self._brushes:
+            self._brushes.move_to_end(key)
+            return self._brushes[key]
+        meta_brushes = make_meta_brushes(vertical_brush, horizontal_brush, self.device)
+        self._brushes[key] = meta_brushes
+        while len(self._brushes) > MAX_CACHED_BRUSH_PAIRS:
+            self._brushes.popitem(last=False)
+        return meta_brushes
+
+    def clear_brushes(self):
+        self._brushes.clear()
+
+
+_sessions = {}
+
+
+def get_session(model_path, device=None, mmap=False):
+    """Returns the cached session for model_path, loading the model on first use."""
+    key = (os.path.abspath(model_path), str(device))
+    if key not in _sessions:
+        _sessions[key] = PaintTransformerSession(model_path, device=device, mmap=mmap)
+    return _sessions[key]
+
+
 def param2stroke(param, H, W, meta_brushes):
     """
     Input a set of stroke parameters and output its corresponding foregrounds and alpha maps.
@@ -23,7 +138,7 @@ def param2stroke(param, H, W, meta_brushes):
         x_center, y_center, width, height, theta, R, G, and B.
         H: output height.
         W: output width.
-        meta_brushes: a tensor with shape 2 x 3 x meta_brush_height x meta_brush_width.
+        meta_brushes: a tensor with shape 2 x 3 x meta_brush_height x meta_brush_width, or a MetaBrushes wrapping it.
          The first slice on the batch dimension denotes vertical brush and the second one denotes horizontal brush.
 
     Returns:
@@ -33,7 +148,10 @@ def param2stroke(param, H, W, meta_brushes):
     """
     # Firstly, resize the meta brushes to the required shape,
     # in order to decrease GPU memory especially when the required shape is small.
-    meta_brushes_resize = F.interpolate(meta_brushes, (H, W))
+    if isinstance(meta_brushes, MetaBrushes):
+        meta_brushes_resize = meta_brushes.resize(H, W)
+    else:
+        meta_brushes_resize = F.interpolate(meta_brushes, (H, W))
     b = param.shape[0]
     # Extract shape parameters and color parameters.
     param_list = torch.split(param, 1, dim=1)
@@ -79,8 +197,49 @@ def param2stroke(param, H, W, meta_brushes):
     return foreground, alphas
 
 
+def chunk_bounds(n, max_size=None, min_size=1):
+    """
+    Splits range(n) into (start, end) chunks of at most max_size items (one chunk
+    when max_size is None). A last chunk smaller than min_size is merged into the
+    previous one.
+    """
+    if max_size is None or n <= max_size:
+        return [(0, n)]
+    bounds = [(start, min(start + max_size, n)) for start in range(0, n, max_size)]
+    if bounds[-1][1] - bounds[-1][0] < min_size:
+        bounds[-2:] = [(bounds[-2][0], n)]
+    return bounds
+
+
+def predict_strokes(net_g, img_patch, result_patch, max_patches=None):
+    """
+    Runs net_g on image / canvas patches (n x 3 x patch_size x patch_size) and samples
+    the stroke colors from the image patches, at most max_patches at a time.
+
+    Returns:
+        stroke_param: n x stroke_num x 8 (5 shape parameters followed by R, G and B).
+        stroke_decision: n x stroke_num x 1, the raw decision logits.
+    """
+    params, decisions = [], []
+    for start, end in chunk_bounds(img_patch.shape[0], max_patches, MIN_NET_CHUNK):
+        img_chunk = img_patch[start:end]
+        shape_param, stroke_decision = net_g(img_chunk, result_patch[start:end])
+        n, stroke_num, patch_size = img_chunk.shape[0], shape_param.shape[1], img_chunk.shape[-1]
+
+        grid = shape_param[:, :, :2].view(n * stroke_num, 1, 1, 2).contiguous()
+        img_temp = img_chunk.unsqueeze(1).contiguous().repeat(1, stroke_num, 1, 1, 1).view(
+            n * stroke_num, 3, patch_size, patch_size).contiguous()
+        color = F.grid_sample(img_temp, 2 * grid - 1, align_corners=False).view(n, stroke_num, 3).contiguous()
+        params.append(torch.cat([shape_param, color], dim=-1))
+        decisions.append(stroke_decision)
+    if len(params) == 1:
+        return params[0], decisions[0]
+    return torch.cat(params), torch.cat(decisions)
+
+
 def param2img_serial(
-        param, decision, meta_brushes, cur_canvas, frame_dir, has_border=False, original_h=None, original_w=None):
+        param, decision, meta_brushes, cur_canvas, frame_dir, has_border=False, original_h=None, original_w=None,
+        canvas_h=None, canvas_w=None):
     """
     Input stroke parameters and decisions for each patch, meta brushes, current canvas, frame directory,
     and whether there is a border (if intermediate painting results are required).
@@ -101,6 +260,8 @@ def param2img_serial(
          on the border before saving, or there would be a black border.
         original_h: to indicate the original height for cropping when saving intermediate results.
         original_w: to indicate the original width for cropping when saving intermediate results.
+        canvas_h, canvas_w: size of the padded image when cur_canvas extends past it at the bottom / right
+         (coarse layers of a rectangular pyramid); the extension is cut off before saving.
 
     Returns:
         cur_canvas: a tensor with shape batch size x 3 x H x W, denoting painting results.
@@ -158,6 +319,15 @@ def param2img_serial(
         factor = 2
     else:
         factor = 4
+
+    def save_frame(canvas):
+        frame = canvas[:, :, patch_size_y // factor:-patch_size_y // factor,
+                       patch_size_x // factor:-patch_size_x // factor]
+        if canvas_h is not None and canvas_w is not None:
+            frame = frame[:, :, :canvas_h, :canvas_w]
+        frame = crop(frame, original_h, original_w)
+        save_img(frame[0], os.path.join(frame_dir, '%03d.jpg' % idx))
+    # Border strips are aligned to the painted block as in param2img_parallel.
     if even_idx_y.shape[0] > 0 and even_idx_x.shape[0] > 0:
         for i in range(s):
             canvas = partial_render(cur_canvas, even_y_even_x_coord_y, even_y_even_x_coord_x, i)
@@ -168,15 +338,14 @@ def param2img_serial(
             cur_canvas = canvas
             idx += 1
             if frame_dir is not None:
-                frame = crop(cur_canvas[:, :, patch_size_y // factor:-patch_size_y // factor,
-                             patch_size_x // factor:-patch_size_x // factor], original_h, original_w)
-                save_img(frame[0], os.path.join(frame_dir, '%03d.jpg' % idx))
+                save_frame(cur_canvas)
 
     if odd_idx_y.shape[0] > 0 and odd_idx_x.shape[0] > 0:
         for i in range(s):
             canvas = partial_render(cur_canvas, odd_y_odd_x_coord_y, odd_y_odd_x_coord_x, i)
-            canvas = torch.cat([cur_canvas[:, :, :patch_size_y // 2, -canvas.shape[3]:], canvas], dim=2)
-            canvas = torch.cat([cur_canvas[:, :, -canvas.shape[2]:, :patch_size_x // 2], canvas], dim=3)
+            canvas = torch.cat([cur_canvas[:, :, :patch_size_y // 2, patch_size_x // 2:patch_size_x // 2 + canvas.shape[3]],
+                                canvas], dim=2)
+            canvas = torch.cat([cur_canvas[:, :, :canvas.shape[2], :patch_size_x // 2], canvas], dim=3)
             if is_odd_y:
                 canvas = torch.cat([canvas, cur_canvas[:, :, -patch_size_y // 2:, :canvas.shape[3]]], dim=2)
             if is_odd_x:
@@ -184,9 +353,7 @@ def param2img_serial(
             cur_canvas = canvas
             idx += 1
             if frame_dir is not None:
-                frame = crop(cur_canvas[:, :, patch_size_y // factor:-patch_size_y // factor,
-                             patch_size_x // factor:-patch_size_x // factor], original_h, original_w)
-                save_img(frame[0], os.path.join(frame_dir, '%03d.jpg' % idx))
+                save_frame(cur_canvas)
 
     if odd_idx_y.shape[0] > 0 and even_idx_x.shape[0] > 0:
         for i in range(s):
@@ -199,31 +366,27 @@ def param2img_serial(
             cur_canvas = canvas
             idx += 1
             if frame_dir is not None:
-                frame = crop(cur_canvas[:, :, patch_size_y // factor:-patch_size_y // factor,
-                             patch_size_x // factor:-patch_size_x // factor], original_h, original_w)
-                save_img(frame[0], os.path.join(frame_dir, '%03d.jpg' % idx))
+                save_frame(cur_canvas)
 
     if even_idx_y.shape[0] > 0 and odd_idx_x.shape[0] > 0:
         for i in range(s):
             canvas = partial_render(cur_canvas, even_y_odd_x_coord_y, even_y_odd_x_coord_x, i)
             canvas = torch.cat([cur_canvas[:, :, :canvas.shape[2], :patch_size_x // 2], canvas], dim=3)
             if not is_odd_y:
-                canvas = torch.cat([canvas, cur_canvas[:, :, -patch_size_y // 2:, -canvas.shape[3]:]], dim=2)
+                canvas = torch.cat([canvas, cur_canvas[:, :, -patch_size_y // 2:, :canvas.shape[3]]], dim=2)
             if is_odd_x:
                 canvas = torch.cat([canvas, cur_canvas[:, :, :canvas.shape[2], -patch_size_x // 2:]], dim=3)
             cur_canvas = canvas
             idx += 1
             if frame_dir is not None:
-                frame = crop(cur_canvas[:, :, patch_size_y // factor:-patch_size_y // factor,
-                             patch_size_x // factor:-patch_size_x // factor], original_h, original_w)
-                save_img(frame[0], os.path.join(frame_dir, '%03d.jpg' % idx))
+                save_frame(cur_canvas)
 
     cur_canvas = cur_canvas[:, :, patch_size_y // 4:-patch_size_y // 4, patch_size_x // 4:-patch_size_x // 4]
 
     return cur_canvas
 
 
-def param2img_parallel(param, decision, meta_brushes, cur_canvas):
+def param2img_parallel(param, decision, meta_brushes, cur_canvas, memory_budget=None):
     """
         Input stroke parameters and decisions for each patch, meta brushes, current canvas, frame directory,
         and whether there is a border (if intermediate painting results are required).
@@ -237,6 +400,9 @@ def param2img_parallel(param, decision, meta_brushes, cur_canvas):
             The first slice on the batch dimension denotes vertical brush and the second one denotes horizontal brush.
             cur_canvas: a tensor with shape batch size x 3 x H x W,
              where H and W denote height and width of padded results of original images.
+            memory_budget: approximate number of bytes the stroke foregrounds and alphas may take.
+             None renders all strokes at once; otherwise they are rendered in chunks of patches,
+             one stroke index at a time, with identical results.
 
         Returns:
             cur_canvas: a tensor with shape batch size x 3 x H x W, denoting painting results.
@@ -261,18 +427,42 @@ def param2img_parallel(param, decision, meta_brushes, cur_canvas):
     odd_y_even_x_coord_y, odd_y_even_x_coord_x = torch.meshgrid([odd_idx_y, even_idx_x])
     cur_canvas = F.pad(cur_canvas, [patch_size_x // 4, patch_size_x // 4,
                                     patch_size_y // 4, patch_size_y // 4, 0, 0, 0, 0])
-    foregrounds = torch.zeros(param.shape[0], 3, patch_size_y, patch_size_x, device=cur_canvas.device)
-    alphas = torch.zeros(param.shape[0], 3, patch_size_y, patch_size_x, device=cur_canvas.device)
-    valid_foregrounds, valid_alphas = param2stroke(param[decision, :], patch_size_y, patch_size_x, meta_brushes)
-    foregrounds[decision, :, :, :] = valid_foregrounds
-    alphas[decision, :, :, :] = valid_alphas
-    # foreground, alpha: b * h * w * stroke_per_patch, 3, patch_size_y, patch_size_x
-    foregrounds = foregrounds.view(-1, h, w, s, 3, patch_size_y, patch_size_x).contiguous()
-    alphas = alphas.view(-1, h, w, s, 3, patch_size_y, patch_size_x).contiguous()
-    # foreground, alpha: b, h, w, stroke_per_patch, 3, render_size_y, render_size_x
-    decision = decision.view(-1, h, w, s, 1, 1, 1).contiguous()
-
-    # decision: b, h, w, stroke_per_patch, 1, 1, 1
+    if memory_budget is None:
+        foregrounds = torch.zeros(param.shape[0], 3, patch_size_y, patch_size_x, device=cur_canvas.device)
+        alphas = torch.zeros(param.shape[0], 3, patch_size_y, patch_size_x, device=cur_canvas.device)
+        valid_foregrounds, valid_alphas = param2stroke(param[decision, :], patch_size_y, patch_size_x, meta_brushes)
+        foregrounds[decision, :, :, :] = valid_foregrounds
+        alphas[decision, :, :, :] = valid_alphas
+        # foreground, alpha: b * h * w * stroke_per_patch, 3, patch_size_y, patch_size_x
+        foregrounds = foregrounds.view(-1, h, w, s, 3, patch_size_y, patch_size_x).contiguous()
+        alphas = alphas.view(-1, h, w, s, 3, patch_size_y, patch_size_x).contiguous()
+        # foreground, alpha: b, h, w, stroke_per_patch, 3, render_size_y, render_size_x
+        decision = decision.view(-1, h, w, s, 1, 1, 1).contiguous()
+
+        # decision: b, h, w, stroke_per_patch, 1, 1, 1
+    else:
+        max_patches = max(1, memory_budget // (3 * patch_size_y * patch_size_x * RENDER_BYTES_PER_VALUE))
+
+    def render_chunked(selected_canvas_patch, patch_coord_y, patch_coord_x):
+        # The selected patches do not overlap, so they can be painted chunk by chunk;
+        # within a chunk the strokes are rendered and composited in their usual order.
+        patches = selected_canvas_patch.reshape(-1, 3, patch_size_y, patch_size_x)
+        selected_param = param.view(b, h, w, s, p)[:, patch_coord_y, patch_coord_x].reshape(-1, s, p)
+        selected_decision = decision.view(b, h, w, s)[:, patch_coord_y, patch_coord_x].reshape(-1, s)
+        for start, end in chunk_bounds(patches.shape[0], max_patches):
+            canvas_chunk = patches[start:end]
+            for i in range(s):
+                cur_decision = selected_decision[start:end, i]
+                cur_foreground = torch.zeros(end - start, 3, patch_size_y, patch_size_x, device=patches.device)
+                cur_alpha = torch.zeros(end - start, 3, patch_size_y, patch_size_x, device=patches.device)
+                if cur_decision.any():
+                    cur_foreground[cur_decision], cur_alpha[cur_decision] = param2stroke(
+                        selected_param[start:end, i][cur_decision], patch_size_y, patch_size_x, meta_brushes)
+                cur_decision = cur_decision.view(-1, 1, 1, 1)
+                canvas_chunk = cur_foreground * cur_alpha * cur_decision + canvas_chunk * (
+                        1 - cur_alpha * cur_decision)
+            patches[start:end] = canvas_chunk
+        return patches.view(selected_canvas_patch.shape)
 
     def partial_render(this_canvas, patch_coord_y, patch_coord_x):
 
@@ -283,15 +473,18 @@ def param2img_parallel(param, decision, meta_brushes, cur_canvas):
         canvas_patch = canvas_patch.permute(0, 4, 5, 1, 2, 3).contiguous()
         # canvas_patch: b, h, w, 3, py, px
         selected_canvas_patch = canvas_patch[:, patch_coord_y, patch_coord_x, :, :, :]
-        selected_foregrounds = foregrounds[:, patch_coord_y, patch_coord_x, :, :, :, :]
-        selected_alphas = alphas[:, patch_coord_y, patch_coord_x, :, :, :, :]
-        selected_decisions = decision[:, patch_coord_y, patch_coord_x, :, :, :, :]
-        for i in range(s):
-            cur_foreground = selected_foregrounds[:, :, :, i, :, :, :]
-            cur_alpha = selected_alphas[:, :, :, i, :, :, :]
-            cur_decision = selected_decisions[:, :, :, i, :, :, :]
-            selected_canvas_patch = cur_foreground * cur_alpha * cur_decision + selected_canvas_patch * (
-                    1 - cur_alpha * cur_decision)
+        if memory_budget is not None:
+            selected_canvas_patch = render_chunked(selected_canvas_patch, patch_coord_y, patch_coord_x)
+        else:
+            selected_foregrounds = foregrounds[:, patch_coord_y, patch_coord_x, :, :, :, :]
+            selected_alphas = alphas[:, patch_coord_y, patch_coord_x, :, :, :, :]
+            selected_decisions = decision[:, patch_coord_y, patch_coord_x, :, :, :, :]
+            for i in range(s):
+                cur_foreground = selected_foregrounds[:, :, :, i, :, :, :]
+                cur_alpha = selected_alphas[:, :, :, i, :, :, :]
+                cur_decision = selected_decisions[:, :, :, i, :, :, :]
+                selected_canvas_patch = cur_foreground * cur_alpha * cur_decision + selected_canvas_patch * (
+                        1 - cur_alpha * cur_decision)
         this_canvas = selected_canvas_patch.permute(0, 3, 1, 4, 2, 5).contiguous()
         # this_canvas: b, 3, h_half, py, w_half, px
         h_half = this_canvas.shape[2]
@@ -300,6 +493,10 @@ def param2img_parallel(param, decision, meta_brushes, cur_canvas):
         # this_canvas: b, 3, h_half * py, w_half * px
         return this_canvas
 
+    # Each group of patches paints a block of the padded canvas; the half-patch
+    # strips around it are copied from the canvas at the same position. On odd
+    # grids the block stops half a patch short of the bottom / right edge, so the
+    # strips are aligned to the block, not to the canvas edge.
     if even_idx_y.shape[0] > 0 and even_idx_x.shape[0] > 0:
         canvas = partial_render(cur_canvas, even_y_even_x_coord_y, even_y_even_x_coord_x)
         if not is_odd_y:
@@ -310,8 +507,9 @@ def param2img_parallel(param, decision, meta_brushes, cur_canvas):
 
     if odd_idx_y.shape[0] > 0 and odd_idx_x.shape[0] > 0:
         canvas = partial_render(cur_canvas, odd_y_odd_x_coord_y, odd_y_odd_x_coord_x)
-        canvas = torch.cat([cur_canvas[:, :, :patch_size_y // 2, -canvas.shape[3]:], canvas], dim=2)
-        canvas = torch.cat([cur_canvas[:, :, -canvas.shape[2]:, :patch_size_x // 2], canvas], dim=3)
+        canvas = torch.cat([cur_canvas[:, :, :patch_size_y // 2, patch_size_x // 2:patch_size_x // 2 + canvas.shape[3]],
+                            canvas], dim=2)
+        canvas = torch.cat([cur_canvas[:, :, :canvas.shape[2], :patch_size_x // 2], canvas], dim=3)
         if is_odd_y:
             canvas = torch.cat([canvas, cur_canvas[:, :, -patch_size_y // 2:, :canvas.shape[3]]], dim=2)
         if is_odd_x:
@@ -331,7 +529,7 @@ def param2img_parallel(param, decision, meta_brushes, cur_canvas):
         canvas = partial_render(cur_canvas, even_y_odd_x_coord_y, even_y_odd_x_coord_x)
         canvas = torch.cat([cur_canvas[:, :, :canvas.shape[2], :patch_size_x // 2], canvas], dim=3)
         if not is_odd_y:
-            canvas = torch.cat([canvas, cur_canvas[:, :, -patch_size_y // 2:, -canvas.shape[3]:]], dim=2)
+            canvas = torch.cat([canvas, cur_canvas[:, :, -patch_size_y // 2:, :canvas.shape[3]]], dim=2)
         if is_odd_x:
             canvas = torch.cat([canvas, cur_canvas[:, :, :canvas.shape[2], -patch_size_x // 2:]], dim=3)
         cur_canvas = canvas
@@ -378,6 +576,24 @@ def pad(img, H, W):
     return img
 
 
+def pad_bottom_right(img, H, W):
+    h, w = img.shape[-2:]
+    return F.pad(img, [0, W - w, 0, H - h, 0, 0, 0, 0])
+
+
+def pyramid_grids(h, w, patch_size=PATCH_SIZE):
+    """
+    Patch grid (rows, cols) of every layer of the Paint Transformer pyramid for an
+    h x w image, coarse to fine. Layer `layer` of K paints cells of
+    patch_size * 2 ** (K - layer) pixels, like the square pyramid, but only as many
+    as needed to cover the image: the finest layer is the image rounded up to the
+    patch grid instead of a power-of-two square.
+    """
+    rows, cols = math.ceil(h / patch_size), math.ceil(w / patch_size)
+    K = max(math.ceil(math.log2(max(rows, cols))), 0)
+    return [(math.ceil(rows / 2 ** (K - layer)), math.ceil(cols / 2 ** (K - layer))) for layer in range(K + 1)]
+
+
 def crop(img, h, w):
     H, W = img.shape[-2:]
     pad_h = (H - h) // 2
@@ -388,147 +604,318 @@ def crop(img, h, w):
     return img
 
 
-def execute_paint_transformer(input_image, vertical_brush , horizontal_brush ,  model_path, output_dir, need_animation=False, resize_h=None, resize_w=None, serial=False):
-    
+def canvas_to_image(canvas, h, w):
+    """Crops a padded 1 x 3 x H x W canvas to h x w and converts it to an h x w x 3 uint8 array."""
+    canvas = crop(canvas, h, w)
+    return (canvas[0].data.cpu().numpy().transpose((1, 2, 0)) * 255).astype(np.uint8)
+
+
+def execute_paint_transformer(input_image, vertical_brush , horizontal_brush ,  model_path, output_dir, need_animation=False, resize_h=None, resize_w=None, serial=False, session=None, memory_budget_mb=None, max_layer=None, cache_strokes=False):
+    """
+    Paints input_image (a PIL image) with the Paint Transformer and returns the result
+    as an H x W x 3 uint8 array.
+    The image is padded to the patch grid, not to a power-of-two square; see pyramid_grids.
+
+    memory_budget_mb bounds the memory of the parallel renderer: the patches are pushed
+    through net_g and rendered in chunks sized to fit in roughly that many megabytes
+    (the output is the same as without a budget). None processes each layer at once.
+
+    max_layer stops after that pyramid layer for a quicker, coarser result (see
+    paint_progressive). With need_animation, a frame per stroke is saved to output_dir.
+
+    With cache_strokes, the predicted strokes are saved in STROKE_CACHE_DIR, keyed by
+    the input image and model, and a later call for the same input only rasterizes
+    them with the given brushes. That is faster but not the same image as a fresh run
+    with those brushes (see StrokeSet), so it is off by default.
     """
-    if not os.path.exists(output_dir):
-        os.mkdir(output_dir)
-    input_name = os.path.basename(input_path)
-    output_path = os.path.join(output_dir, input_name)
     frame_dir = None
     if need_animation:
+        if output_dir is None:
+            raise ValueError("need_animation requires an output_dir to save the frames to.")
         if not serial:
             print('It must be under serial mode if animation results are required, so serial flag is set to True!')
             serial = True
-        frame_dir = os.path.join(output_dir, input_name[:input_name.find('.')])
-        if not os.path.exists(frame_dir):
-            os.mkdir(frame_dir)
-            """
-    
-
-    patch_size = 32
-    stroke_num = 8
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    net_g = network.Painter(5, stroke_num, 256, 8, 3, 3).to(device)
-    net_g.load_state_dict(torch.load(model_path))
-    net_g.eval()
-    for param in net_g.parameters():
-        param.requires_grad = False
+        frame_dir = output_dir
+        os.makedirs(frame_dir, exist_ok=True)
+
+    cache_path = stroke_set = None
+    if cache_strokes:
+        model_path = session.model_path if session is not None else model_path
+        cache_path = stroke_cache_path(input_image, model_path, resize_h, resize_w)
+        stroke_set = StrokeSet.load_cached(cache_path)
+
+    result = None
+    if stroke_set is not None:
+        print("Rendering cached strokes...")
+        for _, _, result in render_progressive(stroke_set, vertical_brush, horizontal_brush, serial=serial,
+                                               session=session, memory_budget_mb=memory_budget_mb,
+                                               max_layer=max_layer, frame_dir=frame_dir):
+            pass
+        return result
+
+    strokes = [] if cache_path is not None and max_layer is None else None
+    for _, _, result in paint_progressive(input_image, vertical_brush, horizontal_brush, model_path,
+                                          resize_h=resize_h, resize_w=resize_w, serial=serial, session=session,
+                                          memory_budget_mb=memory_budget_mb, max_layer=max_layer,
+                                          frame_dir=frame_dir, strokes=strokes):
+        pass
+    if strokes is not None:
+        StrokeSet(result.shape[0], result.shape[1], strokes).save_cached(cache_path)
+    return result
+
+
+def render_layer(param, decision, meta_brushes, layer_result, serial=False, memory_budget=None,
+                 frame_dir=None, original_h=None, original_w=None, canvas_h=None, canvas_w=None):
+    """Paints one pyramid layer of strokes on layer_result (padded to the layer's grid)."""
+    if serial:
+        return param2img_serial(param, decision, meta_brushes, layer_result,
+                                frame_dir, False, original_h, original_w, canvas_h, canvas_w)
+    return param2img_parallel(param, decision, meta_brushes, layer_result, memory_budget)
+
+
+def render_final_pass(param, decision, meta_brushes, final_result, border_size, serial=False, memory_budget=None,
+                      frame_dir=None, original_h=None, original_w=None):
+    """Paints the final layer again, shifted by half a patch (border_size), on final_result."""
+    final_result = F.pad(final_result, [border_size, border_size, border_size, border_size, 0, 0, 0, 0])
+    if serial:
+        final_result = param2img_serial(param, decision, meta_brushes, final_result,
+                                        frame_dir, True, original_h, original_w)
+    else:
+        final_result = param2img_parallel(param, decision, meta_brushes, final_result, memory_budget)
+    return final_result[:, :, border_size:-border_size, border_size:-border_size]
+
 
+def memory_limits(memory_budget_mb):
+    """Render memory budget in bytes and net_g chunk size for memory_budget_mb (None: unbounded)."""
+    if memory_budget_mb is None:
+        return None, None
+    memory_budget = int(memory_budget_mb * 2 ** 20)
+    return memory_budget, max(MIN_NET_CHUNK, memory_budget // NET_BYTES_PER_PATCH)
+
+
+@torch.no_grad()
+def paint_progressive(input_image, vertical_brush, horizontal_brush, model_path=None, resize_h=None, resize_w=None,
+                      serial=False, session=None, memory_budget_mb=None, max_layer=None, frame_dir=None, strokes=None):
     """
-    brush_large_vertical = read_img('brush/brush_small_vertical.png', 'L').to(device)
-    brush_large_horizontal = read_img('brush/brush_small_horizontal.png', 'L').to(device)
+    Paints input_image coarse to fine and yields (layer, num_layers, image) after every
+    layer, image being the canvas so far as an H x W x 3 uint8 array. The pyramid has
+    num_layers - 1 layers; the last yield (layer == num_layers - 1) is the shifted final
+    pass and equals the result of execute_paint_transformer.
+
+    The early canvases can be shown as previews. To save the cost of the finest layers,
+    stop iterating, or pass max_layer to stop after that layer (0 is the coarsest).
+    frame_dir (serial mode only) saves a frame after every stroke.
+    If strokes is a list, the (param, decision) of every layer are appended to it.
     """
 
-    
-
-    brush_large_horizontal = preprocess_img(vertical_brush, 'L').to(device)
-    brush_large_vertical = preprocess_img(horizontal_brush, 'L').to(device)
+    patch_size = PATCH_SIZE
+    stroke_num = STROKE_NUM
+    if session is None:
+        session = get_session(model_path)
+    device = session.device
+    net_g = session.net_g
+    meta_brushes = session.meta_brushes(vertical_brush, horizontal_brush)
+    memory_budget, max_patches = memory_limits(memory_budget_mb)
 
-    meta_brushes = torch.cat(
-        [brush_large_vertical, brush_large_horizontal], dim=0)
-
-
-    with torch.no_grad():
-        #original_img = read_img(input_path, 'RGB', resize_h, resize_w).to(device)
-        original_img = preprocess_img(input_image, 'RGB', resize_h, resize_w).to(device)
-        original_h, original_w = original_img.shape[-2:]
-        K = max(math.ceil(math.log2(max(original_h, original_w) / patch_size)), 0)
-        original_img_pad_size = patch_size * (2 ** K)
-        original_img_pad = pad(original_img, original_img_pad_size, original_img_pad_size)
-        final_result = torch.zeros_like(original_img_pad).to(device)
-        for layer in range(0, K + 1):
-            layer_size = patch_size * (2 ** layer)
-            img = F.interpolate(original_img_pad, (layer_size, layer_size))
-            result = F.interpolate(final_result, (patch_size * (2 ** layer), patch_size * (2 ** layer)))
-            img_patch = F.unfold(img, (patch_size, patch_size), stride=(patch_size, patch_size))
-            result_patch = F.unfold(result, (patch_size, patch_size),
-                                    stride=(patch_size, patch_size))
-            # There are patch_num * patch_num patches in total
-            patch_num = (layer_size - patch_size) // patch_size + 1
-
-            # img_patch, result_patch: b, 3 * output_size * output_size, h * w
-            img_patch = img_patch.permute(0, 2, 1).contiguous().view(-1, 3, patch_size, patch_size).contiguous()
-            result_patch = result_patch.permute(0, 2, 1).contiguous().view(
-                -1, 3, patch_size, patch_size).contiguous()
-            shape_param, stroke_decision = net_g(img_patch, result_patch)
-            stroke_decision = network.SignWithSigmoidGrad.apply(stroke_decision)
-
-            grid = shape_param[:, :, :2].view(img_patch.shape[0] * stroke_num, 1, 1, 2).contiguous()
-            img_temp = img_patch.unsqueeze(1).contiguous().repeat(1, stroke_num, 1, 1, 1).view(
-                img_patch.shape[0] * stroke_num, 3, patch_size, patch_size).contiguous()
-            color = F.grid_sample(img_temp, 2 * grid - 1, align_corners=False).view(
-                img_patch.shape[0], stroke_num, 3).contiguous()
-            stroke_param = torch.cat([shape_param, color], dim=-1)
-            # stroke_param: b * h * w, stroke_per_patch, param_per_stroke
-            # stroke_decision: b * h * w, stroke_per_patch, 1
-            param = stroke_param.view(1, patch_num, patch_num, stroke_num, 8).contiguous()
-            decision = stroke_decision.view(1, patch_num, patch_num, stroke_num).contiguous().bool()
-            # param: b, h, w, stroke_per_patch, 8
-            # decision: b, h, w, stroke_per_patch
-            param[..., :2] = param[..., :2] / 2 + 0.25
-            param[..., 2:4] = param[..., 2:4] / 2
-
-
-            if serial:
-                final_result = param2img_serial(param, decision, meta_brushes, final_result,
-                                                frame_dir, False, original_h, original_w)
-                
-            else:
-                final_result = param2img_parallel(param, decision, meta_brushes, final_result)
-                print("test")
-
-
-        border_size = original_img_pad_size // (2 * patch_num)
-        img = F.interpolate(original_img_pad, (patch_size * (2 ** layer), patch_size * (2 ** layer)))
-        result = F.interpolate(final_result, (patch_size * (2 ** layer), patch_size * (2 ** layer)))
-        img = F.pad(img, [patch_size // 2, patch_size // 2, patch_size // 2, patch_size // 2,
-                          0, 0, 0, 0])
-        result = F.pad(result, [patch_size // 2, patch_size // 2, patch_size // 2, patch_size // 2,
-                                0, 0, 0, 0])
-        
-
-       
+    global idx
+    if frame_dir is not None:
+        idx = 0
+
+    #original_img = read_img(input_path, 'RGB', resize_h, resize_w).to(device)
+    original_img = preprocess_img(input_image, 'RGB', resize_h, resize_w).to(device)
+    original_h, original_w = original_img.shape[-2:]
+    grids = pyramid_grids(original_h, original_w, patch_size)
+    K = len(grids) - 1
+    pad_h, pad_w = grids[-1][0] * patch_size, grids[-1][1] * patch_size
+    original_img_pad = pad(original_img, pad_h, pad_w)
+    final_result = torch.zeros_like(original_img_pad).to(device)
+    num_layers = K + 2
+    for layer, (patch_num_y, patch_num_x) in enumerate(grids):
+        # The cells of the coarse layers may reach past the padded image:
+        # extend it (and the canvas) to the layer's grid while painting it.
+        cell_size = patch_size * 2 ** (K - layer)
+        layer_h, layer_w = patch_num_y * cell_size, patch_num_x * cell_size
+        layer_img = pad_bottom_right(original_img_pad, layer_h, layer_w)
+        layer_result = pad_bottom_right(final_result, layer_h, layer_w)
+        img = F.interpolate(layer_img, (patch_num_y * patch_size, patch_num_x * patch_size))
+        result = F.interpolate(layer_result, (patch_num_y * patch_size, patch_num_x * patch_size))
         img_patch = F.unfold(img, (patch_size, patch_size), stride=(patch_size, patch_size))
-        result_patch = F.unfold(result, (patch_size, patch_size), stride=(patch_size, patch_size))
-        final_result = F.pad(final_result, [border_size, border_size, border_size, border_size, 0, 0, 0, 0])
-        h = (img.shape[2] - patch_size) // patch_size + 1
-        w = (img.shape[3] - patch_size) // patch_size + 1
+        result_patch = F.unfold(result, (patch_size, patch_size),
+                                stride=(patch_size, patch_size))
+
         # img_patch, result_patch: b, 3 * output_size * output_size, h * w
         img_patch = img_patch.permute(0, 2, 1).contiguous().view(-1, 3, patch_size, patch_size).contiguous()
-        result_patch = result_patch.permute(0, 2, 1).contiguous().view(-1, 3, patch_size, patch_size).contiguous()
-        shape_param, stroke_decision = net_g(img_patch, result_patch)
-
-        grid = shape_param[:, :, :2].view(img_patch.shape[0] * stroke_num, 1, 1, 2).contiguous()
-        img_temp = img_patch.unsqueeze(1).contiguous().repeat(1, stroke_num, 1, 1, 1).view(
-            img_patch.shape[0] * stroke_num, 3, patch_size, patch_size).contiguous()
-        color = F.grid_sample(img_temp, 2 * grid - 1, align_corners=False).view(
-            img_patch.shape[0], stroke_num, 3).contiguous()
-        stroke_param = torch.cat([shape_param, color], dim=-1)
+        result_patch = result_patch.permute(0, 2, 1).contiguous().view(
+            -1, 3, patch_size, patch_size).contiguous()
+        stroke_param, stroke_decision = predict_strokes(net_g, img_patch, result_patch, max_patches)
+        stroke_decision = network.SignWithSigmoidGrad.apply(stroke_decision)
         # stroke_param: b * h * w, stroke_per_patch, param_per_stroke
         # stroke_decision: b * h * w, stroke_per_patch, 1
-        param = stroke_param.view(1, h, w, stroke_num, 8).contiguous()
-        decision = stroke_decision.view(1, h, w, stroke_num).contiguous().bool()
+        param = stroke_param.view(1, patch_num_y, patch_num_x, stroke_num, 8).contiguous()
+        decision = stroke_decision.view(1, patch_num_y, patch_num_x, stroke_num).contiguous().bool()
         # param: b, h, w, stroke_per_patch, 8
         # decision: b, h, w, stroke_per_patch
         param[..., :2] = param[..., :2] / 2 + 0.25
         param[..., 2:4] = param[..., 2:4] / 2
-        if serial:
-           final_result = param2img_serial(param, decision, meta_brushes, final_result,
-                                            frame_dir, True, original_h, original_w)
-                            
-        else:
-            final_result = param2img_parallel(param, decision, meta_brushes, final_result)
-        final_result = final_result[:, :, border_size:-border_size, border_size:-border_size]
+        if strokes is not None:
+            strokes.append((param, decision))
+
+        layer_result = render_layer(param, decision, meta_brushes, layer_result, serial, memory_budget,
+                                    frame_dir, original_h, original_w, pad_h, pad_w)
+        final_result = layer_result[:, :, :pad_h, :pad_w]
+        yield layer, num_layers, canvas_to_image(final_result, original_h, original_w)
+        if max_layer is not None and layer >= max_layer:
+            return
+
+    border_size = patch_size // 2
+    img = F.pad(original_img_pad, [patch_size // 2, patch_size // 2, patch_size // 2, patch_size // 2,
+                      0, 0, 0, 0])
+    result = F.pad(final_result, [patch_size // 2, patch_size // 2, patch_size // 2, patch_size // 2,
+                            0, 0, 0, 0])
+
+
+
+    img_patch = F.unfold(img, (patch_size, patch_size), stride=(patch_size, patch_size))
+    result_patch = F.unfold(result, (patch_size, patch_size), stride=(patch_size, patch_size))
+    h = (img.shape[2] - patch_size) // patch_size + 1
+    w = (img.shape[3] - patch_size) // patch_size + 1
+    # img_patch, result_patch: b, 3 * output_size * output_size, h * w
+    img_patch = img_patch.permute(0, 2, 1).contiguous().view(-1, 3, patch_size, patch_size).contiguous()
+    result_patch = result_patch.permute(0, 2, 1).contiguous().view(-1, 3, patch_size, patch_size).contiguous()
+    stroke_param, stroke_decision = predict_strokes(net_g, img_patch, result_patch, max_patches)
+    # stroke_param: b * h * w, stroke_per_patch, param_per_stroke
+    # stroke_decision: b * h * w, stroke_per_patch, 1
+    param = stroke_param.view(1, h, w, stroke_num, 8).contiguous()
+    decision = stroke_decision.view(1, h, w, stroke_num).contiguous().bool()
+    # param: b, h, w, stroke_per_patch, 8
+    # decision: b, h, w, stroke_per_patch
+    param[..., :2] = param[..., :2] / 2 + 0.25
+    param[..., 2:4] = param[..., 2:4] / 2
+    if strokes is not None:
+        strokes.append((param, decision))
+    final_result = render_final_pass(param, decision, meta_brushes, final_result, border_size, serial,
+                                     memory_budget, frame_dir, original_h, original_w)
+    yield num_layers - 1, num_layers, canvas_to_image(final_result, original_h, original_w)
 
 
+STROKE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stroke_cache")
+# A 4K texture's strokes take about 10 MB; past this the least recently used sets are deleted.
+MAX_STROKE_CACHE_BYTES = 256 << 20
 
-        final_result = crop(final_result, original_h, original_w)
-        result = (final_result[0].data.cpu().numpy().transpose((1, 2, 0)) * 255).astype(np.uint8)
-        return result
-    
 
-        #save_img(final_result[0], output_path)
+class StrokeSet:
+    """
+    The strokes predicted for one image: (param, decision) of every pyramid layer,
+    coarse to fine, followed by the shifted final pass, plus the painted image size.
+
+    Stroke positions and sizes are relative to their patch, so a stroke set can be
+    rasterized again with other brushes or at another resolution without net_g (see
+    render_progressive). Note that net_g predicts each layer from the canvas painted
+    so far, i.e. with the brushes used at the time: re-rendering with other brushes
+    keeps the stroke layout rather than matching a fresh run with those brushes.
+    """
 
+    def __init__(self, height, width, layers):
+        self.height = height
+        self.width = width
+        self.layers = [(torch.as_tensor(param).float().cpu(), torch.as_tensor(decision).bool().cpu())
+                       for param, decision in layers]
+
+    def save(self, file):
+        arrays = {"size": np.array([self.height, self.width])}
+        for i, (param, decision) in enumerate(self.layers):
+            arrays[f"param_{i}"] = param.numpy()
+            arrays[f"decision_{i}"] = decision.numpy()
+        np.savez(file, **arrays)
+
+    @classmethod
+    def load(cls, file):
+        with np.load(file) as data:
+            height, width = (int(v) for v in data["size"])
+            count = sum(1 for key in data.files if key.startswith("param_"))
+            layers = [(data[f"param_{i}"], data[f"decision_{i}"]) for i in range(count)]
+        return cls(height, width, layers)
+
+    def save_cached(self, path, max_bytes=MAX_STROKE_CACHE_BYTES):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                self.save(f)
+            os.replace(tmp_path, path)
+            evict(os.path.dirname(path), max_bytes, keep=path, suffix=".npz")
+        except OSError:
+            pass
+
+    @classmethod
+    def load_cached(cls, path):
+        if not os.path.exists(path):
+            return None
+        try:
+            stroke_set = cls.load(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        touch(path)
+        return stroke_set
+
+
+def stroke_cache_path(input_image, model_path, resize_h=None, resize_w=None):
+    image = np.asarray(input_image)
+    digest = hashlib.sha1(brush_hash(image).encode())
+    digest.update(str((os.path.abspath(model_path), resize_h, resize_w)).encode())
+    return os.path.join(STROKE_CACHE_DIR, digest.hexdigest() + ".npz")
+
+
+@torch.no_grad()
+def render_progressive(stroke_set, vertical_brush, horizontal_brush, scale=1.0, serial=False, session=None,
+                       device=None, memory_budget_mb=None, max_layer=None, frame_dir=None):
+    """
+    Rasterizes a StrokeSet with the given brushes, without running net_g, and yields
+    (layer, num_layers, image) like paint_progressive.
 
+    scale resizes the output: strokes are drawn on patches of PATCH_SIZE * scale
+    pixels (rounded to an even size), so scale=2 paints the same strokes at twice the
+    resolution. With scale=1 and the original brushes the result equals the painting
+    the strokes were predicted for.
+    """
+    if session is not None:
+        meta_brushes = session.meta_brushes(vertical_brush, horizontal_brush)
+        device = session.device
+    else:
+        device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        meta_brushes = make_meta_brushes(vertical_brush, horizontal_brush, device)
+    memory_budget, _ = memory_limits(memory_budget_mb)
 
+    global idx
+    if frame_dir is not None:
+        idx = 0
+
+    patch_size = max(2, 2 * round(PATCH_SIZE * scale / 2))
+    original_h = round(stroke_set.height * patch_size / PATCH_SIZE)
+    original_w = round(stroke_set.width * patch_size / PATCH_SIZE)
+    layers, (final_param, final_decision) = stroke_set.layers[:-1], stroke_set.layers[-1]
+    K = len(layers) - 1
+    pad_h, pad_w = layers[-1][0].shape[1] * patch_size, layers[-1][0].shape[2] * patch_size
+    final_result = torch.zeros(1, 3, pad_h, pad_w, device=device)
+    num_layers = K + 2
+    for layer, (param, decision) in enumerate(layers):
+        cell_size = patch_size * 2 ** (K - layer)
+        layer_result = pad_bottom_right(final_result, param.shape[1] * cell_size, param.shape[2] * cell_size)
+        layer_result = render_layer(param.to(device), decision.to(device), meta_brushes, layer_result, serial,
+                                    memory_budget, frame_dir, original_h, original_w, pad_h, pad_w)
+        final_result = layer_result[:, :, :pad_h, :pad_w]
+        yield layer, num_layers, canvas_to_image(final_result, original_h, original_w)
+        if max_layer is not None and layer >= max_layer:
+            return
+
+    final_result = render_final_pass(final_param.to(device), final_decision.to(device), meta_brushes, final_result,
+                                     patch_size // 2, serial, memory_budget, frame_dir, original_h, original_w)
+    yield num_layers - 1, num_layers, canvas_to_image(final_result, original_h, original_w)
+
+
+def render_strokes(stroke_set, vertical_brush, horizontal_brush, scale=1.0, **kwargs):
+    """Rasterizes a StrokeSet and returns the final H x W x 3 uint8 image; see render_progressive."""
+    result = None
+    for _, _, result in render_progressive(stroke_set, vertical_brush, horizontal_brush, scale=scale, **kwargs):
+        pass
+    return result
@@ -2,24 +2,29 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+# Grey-scale erosion / dilation with a (2m + 1) x (2m + 1) square, as min / max
+# pooling. max_pool2d slides the window without materializing it, unlike the
+# unfold versions below (kept as references), which build a (2m + 1)^2 times
+# larger intermediate. Results are identical for values within +-1e9, the
+# padding value of the unfold versions (max_pool2d ignores the border instead).
+
 
 class Erosion2d(nn.Module):
 
     def __init__(self, m=1):
         super(Erosion2d, self).__init__()
         self.m = m
-        self.pad = [m, m, m, m]
-        self.unfold = nn.Unfold(2 * m + 1, padding=0, stride=1)
 
     def forward(self, x):
-        batch_size, c, h, w = x.shape
-        x_pad = F.pad(x, pad=self.pad, mode='constant', value=1e9)
-        channel = self.unfold(x_pad).view(batch_size, c, -1, h, w)
-        result = torch.min(channel, dim=2)[0]
-        return result
+        return erosion(x, self.m)
 
 
 def erosion(x, m=1):
+    result = F.max_pool2d(-x, 2 * m + 1, stride=1, padding=m)
+    return result.neg_()
+
+
+def erosion_slow(x, m=1):
     b, c, h, w = x.shape
     x_pad = F.pad(x, pad=[m, m, m, m], mode='constant', value=1e9)
     channel = nn.functional.unfold(x_pad, 2 * m + 1, padding=0, stride=1).view(b, c, -1, h, w)
@@ -32,18 +37,16 @@ class Dilation2d(nn.Module):
     def __init__(self, m=1):
         super(Dilation2d, self).__init__()
         self.m = m
-        self.pad = [m, m, m, m]
-        self.unfold = nn.Unfold(2 * m + 1, padding=0, stride=1)
 
     def forward(self, x):
-        batch_size, c, h, w = x.shape
-        x_pad = F.pad(x, pad=self.pad, mode='constant', value=-1e9)
-        channel = self.unfold(x_pad).view(batch_size, c, -1, h, w)
-        result = torch.max(channel, dim=2)[0]
-        return result
+        return dilation(x, self.m)
 
 
 def dilation(x, m=1):
+    return F.max_pool2d(x, 2 * m + 1, stride=1, padding=m)
+
+
+def dilation_slow(x, m=1):
     b, c, h, w = x.shape
     x_pad = F.pad(x, pad=[m, m, m, m], mode='constant', value=-1e9)
     channel = nn.functional.unfold(x_pad, 2 * m + 1, padding=0, stride=1).view(b, c, -1, h, w)
@@ -1,7 +1,7 @@
 import numpy as np
 import cv2
-import random
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 from argparse import RawTextHelpFormatter
 
 # provided styles
@@ -10,13 +10,22 @@ EXPRESSIONIST = [50, [8,4,2], .25, 0.5, 0.7, 1, 10, 16] # jitter jv = 0.5
 COLORIST_WASH = [200, [8,4,2], 1, 0.5, 0.5, 1, 4, 16] # jr=jg=jb=0.3
 POINTILLIST = [100, [4,2], 1, 0.5, 0.1, 0.5, 0, 0] # jv=1, jh=0.3
 
+# value of every channel of the blank canvas, far from any color so that the
+# first layer covers the whole image
+BLANK_CANVAS = 4534534245
+
 class painterlybrush:
     def __init__(self):
         self.results = {}
     
-    def paint(self, sourceImg, T, R, fc, fs, a, fg, minl, maxl, retList=0):
-        self.canvas = np.zeros(sourceImg.shape, dtype=int)
-        self.canvas.fill(4534534245.)
+    def paint(self, sourceImg, T, R, fc, fs, a, fg, minl, maxl, retList=0, seed=None, compact=False):
+        # the canvas stays uint8 across layers; until the first layer is painted
+        # it is blank (BLANK_CANVAS, stored as the uint8 it wraps to)
+        self.canvas = np.full(sourceImg.shape, BLANK_CANVAS % 256, dtype=np.uint8)
+        self.blank = True
+        self.rng = np.random.default_rng(seed) # stroke order, reproducible with a seed
+        self.retList = retList # keep the per layer intermediates in self.results
+        self.compact = compact # float32 difference and gradient buffers, for very large images
         self.T = T # approximation threshold
         self.R = R # brush radii
         self.fc = fc # curvature filter, limit or exaggerate stroke curvature
@@ -30,141 +39,247 @@ class painterlybrush:
             sigma = fs * ri
             refImg = np.asarray(cv2.GaussianBlur(sourceImg,(0,0),sigmaX = sigma))
             self.paintLayer(refImg, ri)
-            self.results["After brush size " + str(ri)] = self.canvas/255
+            self.blank = False
+            if retList == 1:
+                self.results["After brush size " + str(ri)] = self.canvas/255
         if retList == 1:
             return self.results
         return self.canvas
 
     def paintLayer(self, refImg, R):
-        # List of strokes
-        S = []
-
-        D = np.sqrt(np.sum((self.canvas-refImg)**2, axis=2))
+        floatType = np.float32 if self.compact else np.float64
+        D = self.canvasDifference(refImg, floatType)
         #D = self.color_diff(self.canvas, refImg)
 
         grid = int(self.fg * R) # fg*Ri = step size in paint layer
+        seeds = self.strokeSeeds(D, grid)
+        del D
 
         numRow, numCol, numCh = refImg.shape
         # Wait! Paper specifies to use luminance for sobel, so YIQ instead of HSV
         #ref_hsv = cv2.cvtColor(refImg, cv2.COLOR_BGR2HSV)
         #val = ref_hsv[:,:,2]
         
-        val = (refImg[:, :, 0] * 0.11) + (refImg[:, :, 1] * 0.59) + (refImg[:, :, 2] * 0.20)
+        val = (refImg[:, :, 0] * floatType(0.11)) + (refImg[:, :, 1] * floatType(0.59)) + (refImg[:, :, 2] * floatType(0.20))
         
-        self.sobelx = cv2.Sobel(val,cv2.CV_64F,1,0,ksize=3)
-        self.sobely = cv2.Sobel(val,cv2.CV_64F,0,1,ksize=3)
+        depth = cv2.CV_32F if self.compact else cv2.CV_64F
+        self.sobelx = cv2.Sobel(val,depth,1,0,ksize=3)
+        self.sobely = cv2.Sobel(val,depth,0,1,ksize=3)
+        del val
         
         self.gradientMag = np.abs(np.sqrt(self.sobelx**2 + self.sobely**2))
         
         # Save the results
-        self.results["Sobel filter for brush size " + str(R)] = self.gradientMag/255
+        if self.retList == 1:
+            self.results["Sobel filter for brush size " + str(R)] = self.gradientMag/255
         
         
-        for x in range(0, numRow, grid):
-            for y in range(0, numCol, grid):
-                
-                #M = D[ max(int((x-grid)//2), 0) : int((x+grid)//2),
-                #  int(max((y-grid)//2), 0) : int((y+grid)//2)]
-                M = D[x:x+grid, y:y+grid]
-                areaError = M.sum() / (grid**2)
-                
-                if areaError > self.T:
-                    x1, y1 = x, y
-                    largeIndex = np.argmax(M, axis=None)
-                    regionIndex = np.unravel_index(largeIndex, M.shape)
-                    x1 += regionIndex[0]
-                    y1 += regionIndex[1]
-                    s = self.makeSplineStroke(x1, y1, R, refImg)
-                    S.append(s)
-
-        # paint all strokes in S on canvas in random order
-        r = list(range(len(S)))
-        random.shuffle(r)
-        self.canvas = (self.canvas).astype(np.uint8)
-        for i in r:
-            # S is list of strokes small s, each small s is a list of points (x, y)
-            # with each point to be painted on canvas with color of refImg[s[0]], since
-            # the first point x0 y0 is the stroke color of the stroke
-            s = S[i]
-            stroke_color = refImg[s[0]]/255
-            stroke_color = stroke_color*255
-            for i in range(1, len(s)):
-                coordss = s[i]
-                cv2.circle(self.canvas,(coordss[1], coordss[0]), R, stroke_color, -1)
+        strokeX, strokeY, strokeLength = self.makeSplineStrokes(*seeds, R, refImg)
+        self.sobelx = self.sobely = self.gradientMag = None
+
+        # paint all strokes on canvas in random order
+        order = self.rng.permutation(len(strokeLength))
+        self.paintStrokes(refImg, R, strokeX, strokeY, strokeLength, order)
         #sigma = self.fs * R
         sigma = R
 
         # Minimize circle apperance by blurring the brush strokes
-        self.canvas = np.asarray(cv2.GaussianBlur(self.canvas,(3,3),sigmaX = sigma))
+        self.canvas = cv2.GaussianBlur(self.canvas,(3,3),sigmaX = sigma)
         #self.canvas = np.asarray(cv2.GaussianBlur(self.canvas,(5,5),0))
-        self.canvas = (self.canvas).astype(int)
-                
 
-    def makeSplineStroke(self, x0,y0,R,refImg):
+    def canvasDifference(self, refImg, floatType=np.float64):
+        # per-pixel color distance between the canvas and refImg, accumulated
+        # one channel at a time so no (H, W, 3) temporaries are needed
+        if self.blank:
+            # squared in int64 like the channels of an int canvas of BLANK_CANVAS
+            square = (np.int64(BLANK_CANVAS) - np.arange(256, dtype=np.int64))**2
+            squared = square[refImg[:, :, 0]]
+            for c in range(1, refImg.shape[2]):
+                squared += square[refImg[:, :, c]]
+        else:
+            squared = np.zeros(refImg.shape[:2], dtype=np.int32)
+            diff = np.empty_like(squared)
+            for c in range(refImg.shape[2]):
+                np.subtract(self.canvas[:, :, c], refImg[:, :, c], out=diff, dtype=np.int32)
+                np.multiply(diff, diff, out=diff)
+                squared += diff
+        return np.sqrt(squared, dtype=floatType)
+
+    def paintStrokes(self, refImg, R, strokeX, strokeY, strokeLength, order):
+        # Paints every point but the first of each stroke as a filled circle of
+        # radius R in the stroke color, strokes in the given order. Rather than
+        # one cv2.circle per point, the rank of the last stroke with a point at
+        # each pixel is dilated by the circle's footprint: that gives the last
+        # stroke covering every pixel, i.e. the color it ends up with.
         numRow, numCol, numCh = self.canvas.shape
-        if (x0 >= numRow) or (y0 >= numCol):
-                return
-        
-        strokeColor = refImg[x0,y0]
-        # K = a new stroke with radius R and color strokeColor
-        K = []
-        K.append((x0, y0))
-        x, y = x0, y0
+        if len(order) == 0:
+            return
+
+        rank = np.empty(len(order), dtype=np.float32)
+        rank[order] = np.arange(len(order))
+
+        steps = np.arange(strokeX.shape[1])
+        painted = (steps >= 1) & (steps < strokeLength[:, None])
+        x, y = strokeX[painted], strokeY[painted]
+        pointRank = np.broadcast_to(rank[:, None], strokeX.shape)[painted]
+
+        # circles centred up to R outside the image still reach into it
+        inside = (x >= -R) & (y >= -R)
+        lastRank = np.full((numRow + 2*R, numCol + 2*R), -1, dtype=np.float32)
+        np.maximum.at(lastRank, (x[inside] + R, y[inside] + R), pointRank[inside])
+
+        footprint = np.zeros((2*R + 1, 2*R + 1), dtype=np.uint8)
+        cv2.circle(footprint, (R, R), R, 1, -1)
+        lastRank = cv2.dilate(lastRank, footprint[::-1, ::-1])[R:R + numRow, R:R + numCol]
 
-        lastDx, lastDy = 0,0
+        covered = lastRank >= 0
+        strokeColor = refImg[strokeX[:, 0], strokeY[:, 0]]
+        self.canvas[covered] = strokeColor[order][lastRank[covered].astype(np.int64)]
 
+    def strokeSeeds(self, D, grid):
+        # Splits D into grid x grid cells (row-major, like walking the grid with
+        # two loops) and returns the (x, y) of the largest error in every cell
+        # whose average error is above T. Border cells are padded with zeros,
+        # which leaves their sum unchanged and, as D >= 0, can never be the
+        # largest error of a cell whose average is above T.
+        numRow, numCol = D.shape
+        cellRows, cellCols = -(-numRow // grid), -(-numCol // grid)
+        padding = ((0, cellRows * grid - numRow), (0, cellCols * grid - numCol))
+
+        cells = np.pad(D, padding) if padding != ((0, 0), (0, 0)) else D
+        cells = cells.reshape(cellRows, grid, cellCols, grid).transpose(0, 2, 1, 3)
+        cells = cells.reshape(cellRows, cellCols, grid * grid)
+
+        areaError = cells.sum(axis=2) / (grid**2)
+        cellX, cellY = np.nonzero(areaError > self.T)
+
+        regionIndex = np.argmax(cells[cellX, cellY], axis=1)
+        return cellX * grid + regionIndex // grid, cellY * grid + regionIndex % grid
+
+    def makeSplineStrokes(self, x0, y0, R, refImg):
+        # Traces the spline stroke of every seed of a layer at once: all strokes
+        # advance one step per iteration and drop out through the termination
+        # tests (minimum/maximum length, colour error, vanishing gradient,
+        # leaving the image). Returns the points as (numStrokes, maxl+2) arrays
+        # of x and y plus the number of points in each stroke.
+        numRow, numCol, numCh = self.canvas.shape
+        numStrokes = len(x0)
+
+        strokeX = np.zeros((numStrokes, self.maxl + 2), dtype=np.int32)
+        strokeY = np.zeros((numStrokes, self.maxl + 2), dtype=np.int32)
+        strokeX[:, 0], strokeY[:, 0] = x0, y0
+        strokeLength = np.ones(numStrokes, dtype=np.int32)
+
+        strokeColor = refImg[x0, y0]
+        x, y = np.array(x0, dtype=np.int64), np.array(y0, dtype=np.int64) # copies, the seeds stay intact
+        lastDx, lastDy = np.zeros(numStrokes), np.zeros(numStrokes)
+        active = np.arange(numStrokes)
 
         for i in range(0,self.maxl+1):
-            
-            if((i > self.minl) and (self.color_diff(refImg[x,y], \
-             self.canvas[x,y]) < self.color_diff(refImg[x,y], strokeColor))):
-            
-                return K
+            xa, ya = x[active], y[active]
 
-            # detect vanishing gradient   
-            if(self.gradientMag[x, y] == 0):
-                return K
+            stop = self.gradientMag[xa, ya] == 0
+            if i > self.minl and not self.blank: # nothing is closer than a stroke's color to the blank canvas
+                ref = refImg[xa, ya]
+                stop |= self.color_diff_array(ref, self.canvas[xa, ya]) < \
+                    self.color_diff_array(ref, strokeColor[active])
+            active, xa, ya = active[~stop], xa[~stop], ya[~stop]
 
-            # get unit vector of gradient
-            #gx, gy = refImg.graidentDirection(x, y)
-            gy, gx = self.sobelx[x,y], self.sobely[x,y]
-            
-            # compute a normal direction
-            dx, dy = -gy, gx
+            # normal to the gradient, turned to follow the last direction
+            dx, dy = -self.sobelx[xa, ya], self.sobely[xa, ya]
+            reverse = lastDx[active] * dx + lastDy[active] * dy < 0
+            dx, dy = np.where(reverse, -dx, dx), np.where(reverse, -dy, dy)
 
-            # if necessary, reverse direction
-            if(lastDx * dx + lastDy * dy < 0):
-                dx, dy = -dx, -dy
-            
             # filter the stroke direction
-            dx = self.fc * dx + (1-self.fc) * (lastDx)
-            dy = self.fc * dy + (1-self.fc) * (lastDy)
+            dx = self.fc * dx + (1-self.fc) * (lastDx[active])
+            dy = self.fc * dy + (1-self.fc) * (lastDy[active])
 
-            dx = dx / np.sqrt(dx**2 + dy**2)
-            dy = dy / np.sqrt(dx**2 + dy**2)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                dx = dx / np.sqrt(dx**2 + dy**2)
+                dy = dy / np.sqrt(dx**2 + dy**2)
 
-            x, y = (int(x+R*dx), int(y+R*dy))
-            
-            
-            if (x >= numRow) or (y >= numCol):
-                return K
-            lastDx, lastDy = dx, dy
+            keep = np.isfinite(dx) & np.isfinite(dy)
+            nx = np.trunc(np.where(keep, xa + R*dx, 0)).astype(np.int64)
+            ny = np.trunc(np.where(keep, ya + R*dy, 0)).astype(np.int64)
+            keep &= (nx < numRow) & (ny < numCol)
+            active, nx, ny, dx, dy = active[keep], nx[keep], ny[keep], dx[keep], dy[keep]
+            if len(active) == 0:
+                break
 
-            # add the point (x,y) to K
-            K.append((x,y))
-            
-        return K
+            x[active], y[active] = nx, ny
+            lastDx[active], lastDy[active] = dx, dy
+            strokeX[active, i + 1], strokeY[active, i + 1] = nx, ny
+            strokeLength[active] += 1
 
-    def color_diff(self, color1, color2):
-        # require RGB order
-        # defined as |(r1, g1, b1) - (r2,g2,b2)| = ((r1-r2)^2 + (g1-g2)^2 + (b1-b2)^2)^(1/2)
+        return strokeX, strokeY, strokeLength
 
-        r_diff = float(color1[0]) - float(color2[0])
-        g_diff = float(color1[1]) - float(color2[1])
-        b_diff = float(color1[2]) - float(color2[2])
+    def color_diff_array(self, color1, color2):
+        # |(r1, g1, b1) - (r2, g2, b2)| for (N, 3) arrays of RGB colors
+        color1 = np.asarray(color1, dtype=np.float64)
+        color2 = np.asarray(color2, dtype=np.float64)
+
+        r_diff = color1[:, 0] - color2[:, 0]
+        g_diff = color1[:, 1] - color2[:, 1]
+        b_diff = color1[:, 2] - color2[:, 2]
 
         return np.sqrt(r_diff**2 + g_diff**2 + b_diff**2)
 
+# Tiled rendering: huge images are split into tiles that overlap by `overlap`
+# pixels on every side, each tile is painted on its own (in a process pool) and
+# the overlaps are cross-faded with linear ramps that sum to one.
+
+def paintTile(job):
+    tile, params, seed, compact = job
+    return painterlybrush().paint(tile, *params, seed=seed, compact=compact)
+
+def tileEdges(size, tileSize):
+    # edges of the tile cores along one axis, split as evenly as possible
+    count = -(-size // tileSize)
+    return np.linspace(0, size, count + 1).round().astype(int)
+
+def tileWeights(start, end, coreStart, coreEnd, size, overlap):
+    # 1 inside the core, ramping down to 0 across the 2*overlap band around
+    # every core edge shared with another tile
+    p = np.arange(start, end) + 0.5
+    w = np.ones(end - start)
+    if coreStart > 0:
+        w = np.minimum(w, (p - (coreStart - overlap)) / (2*overlap))
+    if coreEnd < size:
+        w = np.minimum(w, ((coreEnd + overlap) - p) / (2*overlap))
+    return w.astype(np.float32)
+
+def paintTiled(sourceImg, params, tileSize=2048, overlap=128, workers=None, seed=None, compact=False):
+    numRow, numCol, numCh = sourceImg.shape
+    rows, cols = tileEdges(numRow, tileSize), tileEdges(numCol, tileSize)
+    # keep the ramps of opposite core edges apart
+    overlap = int(min(overlap, np.diff(rows).min() // 2, np.diff(cols).min() // 2))
+
+    regions = []
+    for i in range(len(rows) - 1):
+        for j in range(len(cols) - 1):
+            y0, y1 = max(rows[i] - overlap, 0), min(rows[i+1] + overlap, numRow)
+            x0, x1 = max(cols[j] - overlap, 0), min(cols[j+1] + overlap, numCol)
+            weight = tileWeights(y0, y1, rows[i], rows[i+1], numRow, overlap)[:, None] * \
+                tileWeights(x0, x1, cols[j], cols[j+1], numCol, overlap)[None, :]
+            regions.append((y0, y1, x0, x1, weight))
+
+    seeds = np.random.SeedSequence(seed).spawn(len(regions)) if seed is not None else [None] * len(regions)
+    jobs = [(sourceImg[y0:y1, x0:x1], params, tileSeed, compact)
+            for (y0, y1, x0, x1, weight), tileSeed in zip(regions, seeds)]
+
+    result = np.zeros(sourceImg.shape, dtype=np.float32)
+    def blend(tiles):
+        for (y0, y1, x0, x1, weight), tile in zip(regions, tiles):
+            result[y0:y1, x0:x1] += tile * weight[:, :, None]
+
+    if workers == 1 or len(jobs) == 1:
+        blend(map(paintTile, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            blend(pool.map(paintTile, jobs))
+
+    return np.clip(np.round(result), 0, 255).astype(np.uint8)
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Render a painterly image. \
      \nA python implementation of "Painterly Rendering with Curved Brush Strokes \
@@ -193,6 +308,8 @@ if __name__ == '__main__':
     group.add_argument("--colorist_wash", action="store_true", \
     help="loose and semi-transparent brush strokes")
     group.add_argument("--pointillist", action="store_true", help="densely-placed circles")
+    parser.add_argument('--seed', metavar='SEED', type=int, default=None, \
+    help='seed for the stroke order, for reproducible renders')
 
 
     args = parser.parse_args()
@@ -216,7 +333,7 @@ if __name__ == '__main__':
 
     sourceImg = cv2.imread(args.input[0])
     painter = painterlybrush()
-    res = painter.paint(sourceImg, *params)
+    res = painter.paint(sourceImg, *params, seed=args.seed)
     cv2.imwrite(args.out[0], res)
     
     print("Done!" + " Saved to " + str(args.out[0]))
@@ -1,7 +1,7 @@
-import tensorflow as tf
 import numpy as np
 from PIL import Image
 import os
+from .tflite_backend import make_interpreter, load_image, preprocess_image
 
 BASE_MODEL_DIR = os.path.join(os.path.dirname(__file__), "model_weights")
 STYLE_PREDICT_PATH = os.path.join(BASE_MODEL_DIR, "style_predict.tflite")
@@ -9,7 +9,7 @@ STYLE_TRANSFORM_PATH = os.path.join(BASE_MODEL_DIR, "style_transform.tflite")
 
 def run_style_predict(preprocessed_style_image):
   # Load the model.
-  interpreter = tf.lite.Interpreter(model_path=STYLE_PREDICT_PATH)
+  interpreter = make_interpreter(STYLE_PREDICT_PATH)
 
   # Set model input.
   interpreter.allocate_tensors()
@@ -26,7 +26,7 @@ def run_style_predict(preprocessed_style_image):
 
 def run_style_transform(style_bottleneck, preprocessed_content_image , content_image_size=1024):
   # Load the model.
-  interpreter = tf.lite.Interpreter(model_path=STYLE_TRANSFORM_PATH)
+  interpreter = make_interpreter(STYLE_TRANSFORM_PATH)
 
   # Set model input.
   input_details = interpreter.get_input_details()
@@ -58,24 +58,3 @@ def tensor_to_image(tensor):
         assert tensor.shape[0] == 1
         tensor = tensor[0]
     return tensor
-
-def load_image(path_to_img):
-  img = tf.io.read_file(path_to_img)
-  img = tf.io.decode_image(img, channels=3)
-  img = tf.image.convert_image_dtype(img, tf.float32)
-  img = img[tf.newaxis, :]
-
-  return img
-
-def preprocess_image(image, target_dim):
-  # Resize the image so that the shorter dimension becomes 256px.
-  shape = tf.cast(tf.shape(image)[1:-1], tf.float32)
-  short_dim = min(shape)
-  scale = target_dim / short_dim
-  new_shape = tf.cast(shape * scale, tf.int32)
-  image = tf.image.resize(image, new_shape)
-
-  # Central crop the image.
-  image = tf.image.resize_with_crop_or_pad(image, target_dim, target_dim)
-
-  return image
\ No newline at end of file
@@ -0,0 +1,97 @@
+"""
+Runs the style transfer .tflite models without importing full TensorFlow.
+
+The interpreter comes from `tflite_runtime` (or its successor `ai_edge_litert`)
+when installed, and falls back to `tf.lite` otherwise. Image decoding uses PIL
+and resizing is a NumPy port of `tf.image.resize` (bilinear, half-pixel centers)
+that matches it bit for bit; the transform model is quantized, so even 1e-7
+differences in its input show up as visible colour changes.
+"""
+import numpy as np
+from PIL import Image
+
+_interpreter_class = None
+backend_name = None
+
+
+def _find_interpreter_class():
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter, "tflite_runtime"
+    except ImportError:
+        pass
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter, "ai_edge_litert"
+    except ImportError:
+        pass
+    import tensorflow as tf
+    return tf.lite.Interpreter, "tensorflow"
+
+
+def make_interpreter(model_path):
+    """Creates a TFLite interpreter for model_path using the lightest available runtime."""
+    global _interpreter_class, backend_name
+    if _interpreter_class is None:
+        _interpreter_class, backend_name = _find_interpreter_class()
+    return _interpreter_class(model_path=model_path)
+
+
+def load_image(path_to_img):
+    """
+    Decodes an image file to a float32 RGB batch of shape (1, H, W, 3) in [0, 1],
+    like `tf.io.decode_image(channels=3)` followed by `tf.image.convert_image_dtype`.
+    """
+    img = np.asarray(Image.open(path_to_img).convert("RGB"), dtype=np.float32)
+    img = img * np.float32(1 / 255.0)
+    return img[np.newaxis, :]
+
+
+def _bilinear_weights(out_size, in_size):
+    # Same float32 arithmetic as TensorFlow's ResizeBilinear with half_pixel_centers.
+    scale = np.float32(in_size) / np.float32(out_size)
+    position = (np.arange(out_size, dtype=np.float32) + np.float32(0.5)) * scale - np.float32(0.5)
+    position_floor = np.floor(position)
+    lower = np.maximum(position_floor, 0).astype(np.int64)
+    upper = np.minimum(np.ceil(position), in_size - 1).astype(np.int64)
+    return lower, upper, (position - position_floor).astype(np.float32)
+
+
+def resize_bilinear(image, new_h, new_w):
+    """Resizes an (H, W, C) float32 image exactly like `tf.image.resize(..., 'bilinear')`."""
+    h, w = image.shape[:2]
+    y0, y1, y_lerp = _bilinear_weights(new_h, h)
+    x0, x1, x_lerp = _bilinear_weights(new_w, w)
+    x_lerp = x_lerp[np.newaxis, :, np.newaxis]
+    y_lerp = y_lerp[:, np.newaxis, np.newaxis]
+
+    rows_top, rows_bottom = image[y0], image[y1]
+    top_left, top_right = rows_top[:, x0], rows_top[:, x1]
+    bottom_left, bottom_right = rows_bottom[:, x0], rows_bottom[:, x1]
+
+    top = top_left + (top_right - top_left) * x_lerp
+    bottom = bottom_left + (bottom_right - bottom_left) * x_lerp
+    return top + (bottom - top) * y_lerp
+
+
+def preprocess_image(image, target_dim):
+    """
+    Resizes a (1, H, W, 3) float32 batch so that its shorter side is target_dim
+    (bilinear, half-pixel centers, no antialiasing) and center crops / pads it
+    to target_dim x target_dim.
+    """
+    shape = np.array(image.shape[1:-1], dtype=np.float32)
+    short_dim = min(shape)
+    scale = np.float32(target_dim) / short_dim
+    new_h, new_w = (shape * scale).astype(np.int32)
+
+    resized = resize_bilinear(image[0], int(new_h), int(new_w))
+
+    # Central crop (or zero pad) to target_dim x target_dim.
+    output = np.zeros((target_dim, target_dim, resized.shape[-1]), dtype=np.float32)
+    crop_y, crop_x = max(new_h - target_dim, 0) // 2, max(new_w - target_dim, 0) // 2
+    pad_y, pad_x = max(target_dim - new_h, 0) // 2, max(target_dim - new_w, 0) // 2
+    h, w = min(new_h, target_dim), min(new_w, target_dim)
+    output[pad_y:pad_y + h, pad_x:pad_x + w] = resized[crop_y:crop_y + h, crop_x:crop_x + w]
+
+    return output[np.newaxis, :]
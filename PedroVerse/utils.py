@@ -1,7 +1,6 @@
 import os
 import cv2
 import numpy as np
-import scipy.spatial
 import argparse
 from PIL import Image, ImageSequence
 
@@ -17,37 +16,67 @@ def edge_detection(img, line_width, blur_amount):
     )
     return img_edges
 
-def generate_voronoi_pattern(img_shape, num_cells):
-    """Generates a Voronoi pattern and applies directional blur."""
-    height, width = img_shape[:2]
-    
-    print(f"Generating Voronoi pattern with {num_cells} cells...")
-    
-    # Generate random seed points
-    points = np.random.randint(0, (width, height), size=(num_cells, 2))
+def voronoi_cells(height, width, num_cells, rng=None):
+    """Draws a Voronoi tessellation of `num_cells` random seeds as grayscale cells."""
+    import scipy.spatial
 
-    # Compute Voronoi tessellation
-    vor = scipy.spatial.Voronoi(points)
+    # Generate random seed points
+    if rng is None:
+        points = np.random.randint(0, (width, height), size=(num_cells, 2))
+    else:
+        points = rng.integers(0, (width, height), size=(num_cells, 2))
+
+    # Compute Voronoi tessellation. The seeds are mirrored across the four image
+    # borders so that every cell of a real seed is bounded, border cells
+    # included, and ends at the image edge.
+    mirrored = [points,
+                np.column_stack([-1 - points[:, 0], points[:, 1]]),
+                np.column_stack([2 * width - 1 - points[:, 0], points[:, 1]]),
+                np.column_stack([points[:, 0], -1 - points[:, 1]]),
+                np.column_stack([points[:, 0], 2 * height - 1 - points[:, 1]])]
+    vor = scipy.spatial.Voronoi(np.concatenate(mirrored))
 
     # Create an empty image
     voronoi_img = np.zeros((height, width), dtype=np.uint8)
 
-    # Fill Voronoi regions with different grayscale values
-    for i, region in enumerate(vor.regions):
+    # Fill Voronoi regions with different grayscale values, graded by region
+    # order (which follows the tessellation, giving smooth large-scale shading)
+    point_region = vor.point_region[:num_cells]
+    for i, point in enumerate(np.argsort(point_region, kind="stable")):
+        region = vor.regions[point_region[point]]
         if not -1 in region and len(region) > 0:
-            polygon = [vor.vertices[i] for i in region]
-            polygon = np.array(polygon, np.int32)
+            polygon = np.array(vor.vertices[region], np.int32)
             cv2.fillPoly(voronoi_img, [polygon], (i * 255 // num_cells))
 
-    # Apply directional motion blur
-    kernel_size = 15
-    kernel = np.zeros((kernel_size, kernel_size))
-    kernel[:, int(kernel_size / 2)] = np.ones(kernel_size)  # Vertical blur
-    kernel = kernel / kernel_size
+    return voronoi_img
+
+def motion_blur(img, kernel_size=15):
+    """Vertical motion blur; multi-channel images are blurred per channel in one call."""
+    kernel = np.ones((kernel_size, 1)) / kernel_size  # Vertical blur
+    return cv2.filter2D(img, -1, kernel)
+
+def generate_voronoi_pattern(img_shape, num_cells, rng=None):
+    """Generates a Voronoi pattern and applies directional blur."""
+    height, width = img_shape[:2]
+    
+    print(f"Generating Voronoi pattern with {num_cells} cells...")
+    
+    return motion_blur(voronoi_cells(height, width, num_cells, rng))
+
+def generate_voronoi_patterns(img_shape, cell_counts, rng=None):
+    """
+    Generates one blurred Voronoi pattern per entry of `cell_counts`, returned as
+    the channels of a single (H, W, len(cell_counts)) uint8 array.
+    """
+    height, width = img_shape[:2]
+
+    print(f"Generating {len(cell_counts)} Voronoi patterns with {[int(n) for n in cell_counts]} cells...")
 
-    blurred_voronoi = cv2.filter2D(voronoi_img, -1, kernel)
+    patterns = np.empty((height, width, len(cell_counts)), dtype=np.uint8)
+    for i, num_cells in enumerate(cell_counts):
+        patterns[:, :, i] = voronoi_cells(height, width, int(num_cells), rng)
 
-    return blurred_voronoi
+    return motion_blur(patterns).reshape(height, width, -1)
 
 
 def save_steps_as_gif(steps, output_path):
@@ -96,4 +125,42 @@ def apply_bilateral_filter(img, diameter=9, sigma_color=75, sigma_space=75):
     Returns:
         np.ndarray: Smoothed image.
     """
-    return cv2.bilateralFilter(img, diameter, sigma_color, sigma_space)
\ No newline at end of file
+    return cv2.bilateralFilter(img, diameter, sigma_color, sigma_space)
+
+def guided_upsample(low_res, guide, radius=1, eps=1e-2):
+    """
+    Upsamples `low_res` to the size of `guide` with a fast guided filter
+    (He & Sun, 2015): the per-pixel linear model between guide and output is
+    fitted at low resolution and applied to the full resolution guide, so edges
+    follow the guide instead of being interpolated. Each channel of the guide
+    guides the same channel of the output.
+
+    Parameters:
+        low_res (np.ndarray): Processed image at reduced resolution (uint8).
+        guide (np.ndarray): Full resolution image with the same channels (uint8).
+        radius (int): Box radius of the local linear model, in low resolution pixels.
+        eps (float): Regularization; larger values give smoother, less guided results.
+
+    Returns:
+        np.ndarray: uint8 image of the guide's size.
+    """
+    height, width = guide.shape[:2]
+    low_height, low_width = low_res.shape[:2]
+    ksize = (2 * radius + 1, 2 * radius + 1)
+
+    scale = np.float32(1 / 255.0)
+    guide_low = cv2.resize(guide, (low_width, low_height), interpolation=cv2.INTER_AREA) * scale
+    src = low_res * scale
+
+    mean_guide = cv2.boxFilter(guide_low, -1, ksize)
+    mean_src = cv2.boxFilter(src, -1, ksize)
+    var_guide = cv2.boxFilter(guide_low * guide_low, -1, ksize) - mean_guide * mean_guide
+    cov = cv2.boxFilter(guide_low * src, -1, ksize) - mean_guide * mean_src
+
+    a = cov / (var_guide + np.float32(eps))
+    b = mean_src - a * mean_guide
+    a = cv2.resize(cv2.boxFilter(a, -1, ksize), (width, height), interpolation=cv2.INTER_LINEAR)
+    b = cv2.resize(cv2.boxFilter(b, -1, ksize), (width, height), interpolation=cv2.INTER_LINEAR)
+
+    output = (a * (guide * scale) + b).reshape(guide.shape)
+    return np.clip(np.round(output * 255), 0, 255).astype(np.uint8)
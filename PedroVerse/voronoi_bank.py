@@ -0,0 +1,71 @@
+"""
+On-disk bank of pre-generated Voronoi patterns for the watercolor effect.
+
+The patterns do not depend on the image content, only on its size, so instead
+of tessellating new ones on every run the effect can draw them from a fixed,
+seeded set per resolution. Each pattern is generated once, saved as a .npy file
+and memory-mapped on later runs. The bank is bounded in size on disk: when it
+grows past `max_bytes`, the least recently used patterns are deleted.
+"""
+import os
+import numpy as np
+
+from .utils import generate_voronoi_pattern
+from .disk_cache import evict, touch
+
+BANK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "voronoi_bank")
+MAX_BANK_BYTES = 1 << 30
+
+# Patterns kept per resolution; a run draws its layers from these.
+BANK_SIZE = 16
+
+# Same range of cell counts as generate_water_color draws from.
+MIN_CELLS, MAX_CELLS = 500, 1000
+
+
+def bank_entry(index):
+    """Cell count and generator of bank pattern `index` (the same for every resolution)."""
+    rng = np.random.default_rng(index)
+    return int(rng.integers(MIN_CELLS, MAX_CELLS)), rng
+
+
+def pattern_path(bank_dir, height, width, num_cells, index):
+    return os.path.join(bank_dir, f"{height}x{width}_{num_cells}cells_{index}.npy")
+
+
+def load_pattern(height, width, index, bank_dir=BANK_DIR, max_bytes=MAX_BANK_BYTES):
+    """
+    Returns bank pattern `index` for a height x width image as a read-only
+    memory-mapped array, generating and storing it first if needed.
+    """
+    num_cells, rng = bank_entry(index)
+    path = pattern_path(bank_dir, height, width, num_cells, index)
+    if os.path.exists(path):
+        try:
+            pattern = np.load(path, mmap_mode="r")
+            touch(path)
+            return pattern
+        except (OSError, ValueError):
+            pass
+
+    pattern = generate_voronoi_pattern((height, width), num_cells, rng)
+
+    try:
+        os.makedirs(bank_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, pattern)
+        os.replace(tmp_path, path)
+        evict(bank_dir, max_bytes, keep=path)
+    except OSError:
+        pass
+
+    return pattern
+
+
+def sample_patterns(img_shape, num_patterns, rng, bank_dir=BANK_DIR, max_bytes=MAX_BANK_BYTES):
+    """Draws `num_patterns` distinct bank patterns (when possible) for an image of img_shape."""
+    height, width = img_shape[:2]
+    indices = rng.choice(BANK_SIZE, size=num_patterns, replace=num_patterns > BANK_SIZE)
+    print(f"Using Voronoi patterns {[int(i) for i in indices]} from the pattern bank...")
+    return [load_pattern(height, width, int(i), bank_dir, max_bytes) for i in indices]
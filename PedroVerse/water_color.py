@@ -1,10 +1,9 @@
 import os
 import cv2
 import numpy as np
-import scipy.spatial
 import argparse
 from PIL import Image, ImageSequence
-from .utils import generate_voronoi_pattern
+from .utils import generate_voronoi_patterns, guided_upsample
 
 
 def generate_water_color(
@@ -13,7 +12,11 @@ def generate_water_color(
     oil_paint_size=12,
     oil_paint_dyn_ratio=10,
     use_bilateral_filter=True,
-    return_steps=False
+    return_steps=False,
+    seed=None,
+    use_pattern_bank=False,
+    smoothing_scale=1.0,
+    upsample_mode="bilinear"
 ):
     """
     Applies a cartoonizing effect to an image using oil painting and Voronoi patterns.
@@ -25,6 +28,15 @@ def generate_water_color(
         oil_paint_dyn_ratio: dynRatio parameter for oil painting effect.
         use_bilateral_filter: Whether to apply bilateral filtering before oil painting.
         return_steps: If True, return a list of (label, image) steps. If False, return only the final image.
+        seed: Seed for the Voronoi patterns; the same seed gives the same result.
+        use_pattern_bank: Draw the Voronoi patterns from the on-disk pattern bank
+            (see voronoi_bank.py) instead of generating new ones.
+        smoothing_scale: Resolution factor (0, 1] for the bilateral and oil painting
+            stages. Below 1 they run on a downscaled copy with proportionally
+            smaller kernels, which is much faster on large textures.
+        upsample_mode: How the smoothed image is brought back to full size when
+            smoothing_scale < 1: "bilinear" or "guided" (guided filter using the
+            input as the guide, which keeps more of the input's fine detail).
 
     Returns:
         Final cartoonized image, or list of intermediate steps if return_steps=True.
@@ -34,31 +46,58 @@ def generate_water_color(
     if return_steps:
         steps.append(("01_Original_Image", img))
 
+    full_size = (img.shape[1], img.shape[0])
+    downscaled = smoothing_scale < 1
+    if downscaled:
+        guide = img
+        small_size = (max(1, round(full_size[0] * smoothing_scale)), max(1, round(full_size[1] * smoothing_scale)))
+        print(f"Smoothing at {small_size[0]}x{small_size[1]}...")
+        img = cv2.resize(img, small_size, interpolation=cv2.INTER_AREA)
+        oil_paint_size = max(1, round(oil_paint_size * smoothing_scale))
+
     if use_bilateral_filter:
         print("Applying bilateral filter...")
-        img = cv2.bilateralFilter(img, d=7, sigmaColor=200, sigmaSpace=200)
+        diameter = max(3, round(7 * smoothing_scale)) if downscaled else 7
+        sigma_space = 200 * smoothing_scale if downscaled else 200
+        img = cv2.bilateralFilter(img, d=diameter, sigmaColor=200, sigmaSpace=sigma_space)
         if return_steps:
-            steps.append(("02_Smooth_Bilateral_Filter", img))
+            steps.append(("02_Smooth_Bilateral_Filter", cv2.resize(img, full_size) if downscaled else img))
 
     print("Applying oil painting effect...")
     oil_paint_img = cv2.xphoto.oilPainting(img, size=oil_paint_size, dynRatio=oil_paint_dyn_ratio)
+    if downscaled:
+        if upsample_mode == "guided":
+            oil_paint_img = guided_upsample(oil_paint_img, guide)
+        elif upsample_mode == "bilinear":
+            oil_paint_img = cv2.resize(oil_paint_img, full_size, interpolation=cv2.INTER_LINEAR)
+        else:
+            raise ValueError(f"Unknown upsample mode '{upsample_mode}'. Valid options are: ['guided', 'bilinear']")
     if return_steps:
         steps.append(("03_Oil_Painting_Effect", oil_paint_img))
 
     print("Generating and blending Voronoi patterns...")
-    accumulated_voronoi = np.ones_like(oil_paint_img) * 255
-    for i in range(num_voronoi_patterns):
-        num_cells = np.random.randint(500, 1000)
-        voronoi_pattern = generate_voronoi_pattern(oil_paint_img.shape, num_cells)
-        voronoi_pattern = cv2.merge([voronoi_pattern] * 3)
+    rng = np.random.default_rng(seed)
+    if use_pattern_bank:
+        from .voronoi_bank import sample_patterns
+        voronoi_patterns = sample_patterns(oil_paint_img.shape, num_voronoi_patterns, rng)
+    else:
+        cell_counts = rng.integers(500, 1000, size=num_voronoi_patterns)
+        batch = generate_voronoi_patterns(oil_paint_img.shape, cell_counts, rng)
+        voronoi_patterns = [batch[:, :, i] for i in range(num_voronoi_patterns)]
 
+    # The patterns only modulate brightness: accumulate them as one float32
+    # channel and broadcast it to the color channels in the final blend
+    accumulated_voronoi = np.full(oil_paint_img.shape[:2], 255, dtype=np.float32)
+    for i, voronoi_pattern in enumerate(voronoi_patterns):
         if return_steps:
-            steps.append((f"04_Voronoi_Pattern_{i+1}", voronoi_pattern))
+            steps.append((f"04_Voronoi_Pattern_{i+1}", cv2.merge([np.asarray(voronoi_pattern)] * 3)))
 
-        accumulated_voronoi = cv2.multiply(accumulated_voronoi, voronoi_pattern, scale=1/255.0)
+        accumulated_voronoi *= voronoi_pattern * np.float32(1/255.0)
 
     print("Blending final image...")
-    final_img = cv2.addWeighted(oil_paint_img, 0.85, accumulated_voronoi, 0.15, 0)
+    final_img = oil_paint_img * np.float32(0.85)
+    final_img += accumulated_voronoi[:, :, np.newaxis] * np.float32(0.15)
+    final_img = np.clip(np.round(final_img), 0, 255).astype(np.uint8)
     if return_steps:
         steps.append(("05_Final_Cartoonized", final_img))
         return steps
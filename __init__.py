@@ -21,6 +21,7 @@ from . import recolor
 from . import texture
 from . import abstruction
 from . import normal
+from . import effect_worker
 
 
 # ----------------------------------------------------------------------
@@ -91,6 +92,7 @@ def unregister():
     texture.unregister()
     abstruction.unregister()
     normal.unregister()
+    effect_worker.shutdown_worker()
 
     bpy.utils.unregister_class(PedroVersePanel)
     for pcoll in globals.recolor_preview.values():
@@ -1,9 +1,9 @@
 import bpy
-import subprocess
 import os
 import uuid
 from bpy.utils import previews
 from . import globals
+from .effect_worker import get_worker, EffectWorkerError
 
 # Preview cache
 recolor_preview = {}
@@ -35,6 +35,11 @@ class Texture2Settings(bpy.types.PropertyGroup):
 
     slic_num_segments: bpy.props.IntProperty(name="Number of Segments", default=300, min=10, max=1000)
     slic_compactness: bpy.props.IntProperty(name="Compactness", default=50, min=1, max=100)
+    slic_max_side: bpy.props.IntProperty(
+        name="SLIC Resolution",
+        description="Segment a copy downscaled to this size on its longest side (0 = full resolution)",
+        default=0, min=0, max=8192
+    )
 
     # Neural Painter
     vertical_brush_path: bpy.props.StringProperty(
@@ -47,18 +52,54 @@ class Texture2Settings(bpy.types.PropertyGroup):
         description="Path to horizontal brush texture",
         subtype='FILE_PATH'
     )
+    painter_memory_budget: bpy.props.IntProperty(
+        name="Memory Budget (MB)",
+        description="Approximate memory limit for painting; 0 means unlimited",
+        default=2048, min=0
+    )
+    painter_preview_layers: bpy.props.IntProperty(
+        name="Preview Layers",
+        description="Only paint this many coarse layers for a quick preview; 0 paints every layer",
+        default=0, min=0
+    )
+    painter_cache_strokes: bpy.props.BoolProperty(
+        name="Reuse Cached Strokes",
+        description="Keep the strokes predicted for a texture and only redraw them when the brushes change. "
+                    "Faster, but keeps the stroke layout of the first run instead of repainting for the new brushes",
+        default=False
+    )
 
     # Voronoi
     num_voronoi_patterns: bpy.props.IntProperty(name="Number of Voronoi Patterns", default=3, min=1, max=20)
     oil_paint_size: bpy.props.IntProperty(name="Oil Paint Size", default=12, min=1, max=50)
     oil_paint_dyn_ratio: bpy.props.IntProperty(name="Oil Paint Dynamic Ratio", default=10, min=1, max=50)
     use_bilateral_filter: bpy.props.BoolProperty(name="Use Bilateral Filter", default=True)
+    use_voronoi_bank: bpy.props.BoolProperty(
+        name="Reuse Cached Patterns",
+        description="Draw the Voronoi layers from 16 fixed patterns cached on disk (up to 1 GB) instead of new random ones",
+        default=False
+    )
+    voronoi_smoothing_scale: bpy.props.FloatProperty(name="Smoothing Resolution", default=1.0, min=0.1, max=1.0)
+    voronoi_upsample_mode: bpy.props.EnumProperty(
+        name="Smoothing Upsample",
+        description="How the smoothing result is scaled back up when Smoothing Resolution is below 1",
+        items=[
+            ('bilinear', "Bilinear", "Fast; keeps the soft look of the oil painting filter"),
+            ('guided', "Guided", "Guided filter on the full resolution texture; restores more of its edges"),
+        ],
+        default='bilinear'
+    )
 
     # Brushstyle checkboxes
     brushstyle_expressionist: bpy.props.BoolProperty(name="Expressionist")
     brushstyle_impressionist: bpy.props.BoolProperty(name="Impressionist")
     brushstyle_colorist: bpy.props.BoolProperty(name="Colorist Wash")
     brushstyle_pointillist: bpy.props.BoolProperty(name="Pointillist")
+    brushstyle_tile_size: bpy.props.IntProperty(
+        name="Tile Size",
+        description="Paint textures larger than this in tiles on all CPU cores (0 = never)",
+        default=0, min=0, max=16384
+    )
 
 
 # ----------------------------
@@ -142,7 +183,10 @@ class TEXTURE2_OT_ApplyEffect(bpy.types.Operator):
             effect_id = "brush"
             effect_args = [
                 bpy.path.abspath(settings.vertical_brush_path),
-                bpy.path.abspath(settings.horizontal_brush_path)
+                bpy.path.abspath(settings.horizontal_brush_path),
+                str(settings.painter_memory_budget),
+                str(settings.painter_preview_layers),
+                str(int(settings.painter_cache_strokes))
             ]
 
         elif settings.active_option == 'OPTION_3':
@@ -151,7 +195,11 @@ class TEXTURE2_OT_ApplyEffect(bpy.types.Operator):
                 str(settings.num_voronoi_patterns),
                 str(settings.oil_paint_size),
                 str(settings.oil_paint_dyn_ratio),
-                str(int(settings.use_bilateral_filter))
+                str(int(settings.use_bilateral_filter)),
+                "-1",  # random seed
+                str(int(settings.use_voronoi_bank)),
+                str(settings.voronoi_smoothing_scale),
+                settings.voronoi_upsample_mode
             ]
 
         elif settings.active_option == 'OPTION_4':
@@ -166,23 +214,21 @@ class TEXTURE2_OT_ApplyEffect(bpy.types.Operator):
                 effect_args = ["--pointillist"]
             else:
                 effect_args = ["--expressionist"]  # fallback
+            effect_args.append(str(settings.brushstyle_tile_size))
 
 
         elif settings.active_option == 'OPTION_5':
             effect_id = "slicstylize"
             effect_args = [
                 str(settings.slic_num_segments),
-                str(settings.slic_compactness)
+                str(settings.slic_compactness),
+                str(settings.slic_max_side)
             ]
-        python_file = os.path.join(os.path.dirname(__file__), "run_effect_subprocess.py")
-        args = [globals.PYTHON, python_file, effect_id, input_path, output_path] + effect_args
-
         try:
-            result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            if result.returncode != 0 or result.stdout.strip() == "":
-                self.report({'ERROR'}, "Effect subprocess failed.")
-                print("hi" + result.stdout.strip() + "ih")
-                self.report({'ERROR'}, result.stderr)
+            try:
+                get_worker().run(effect_id, input_path, output_path, effect_args)
+            except EffectWorkerError as e:
+                self.report({'ERROR'}, f"Effect worker failed: {e}")
                 return {'CANCELLED'}
 
             new_img = bpy.data.images.load(output_path)
@@ -193,7 +239,7 @@ class TEXTURE2_OT_ApplyEffect(bpy.types.Operator):
             return {'FINISHED'}
 
         except Exception as e:
-            self.report({'ERROR'}, f"Failed to run subprocess: {e}")
+            self.report({'ERROR'}, f"Failed to apply effect: {e}")
             return {'CANCELLED'}
 
 
@@ -212,12 +258,18 @@ def draw_geometric_abstraction_layout(layout, context):
     elif settings.active_option == 'OPTION_2':
         layout.prop(settings, "vertical_brush_path")
         layout.prop(settings, "horizontal_brush_path")
+        layout.prop(settings, "painter_memory_budget")
+        layout.prop(settings, "painter_preview_layers")
+        layout.prop(settings, "painter_cache_strokes")
 
     elif settings.active_option == 'OPTION_3':
         layout.prop(settings, "num_voronoi_patterns")
         layout.prop(settings, "oil_paint_size")
         layout.prop(settings, "oil_paint_dyn_ratio")
         layout.prop(settings, "use_bilateral_filter")
+        layout.prop(settings, "use_voronoi_bank")
+        layout.prop(settings, "voronoi_smoothing_scale")
+        layout.prop(settings, "voronoi_upsample_mode")
 
     elif settings.active_option == 'OPTION_4':
         box = layout.box()
@@ -228,10 +280,12 @@ def draw_geometric_abstraction_layout(layout, context):
         row2 = box.row()
         row2.prop(settings, "brushstyle_colorist")
         row2.prop(settings, "brushstyle_pointillist")
+        box.prop(settings, "brushstyle_tile_size")
     
     elif settings.active_option == 'OPTION_5':
         layout.prop(settings, "slic_num_segments")
         layout.prop(settings, "slic_compactness")
+        layout.prop(settings, "slic_max_side")
 
     layout.operator("texture2.apply_effect", text="Apply Effect")
 
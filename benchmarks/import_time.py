@@ -0,0 +1,78 @@
+"""
+Cold-start import benchmark for the PedroVerse effects.
+
+Each effect id is loaded in a fresh interpreter (so nothing is cached in
+sys.modules) and the wall time of `import PedroVerse` plus
+`PedroVerse.load_effect(effect_id)` is reported.
+
+Usage:
+    python benchmarks/import_time.py [--repeat N] [--budget SECONDS] [effect ...]
+
+With --budget the script exits non-zero if any effect's best time exceeds it,
+so it can be used to catch import-time regressions. Effects that fail to import
+(e.g. pixelate without pyxelate installed) are listed separately and never
+fail the run.
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EFFECT_IDS = ["pixelate", "brush", "voronoi", "brushstyle", "slicstylize", "texture"]
+
+PROBE = """
+import time
+start = time.perf_counter()
+import PedroVerse
+package_time = time.perf_counter() - start
+{load}
+print(package_time, time.perf_counter() - start)
+"""
+
+
+def measure(effect_id):
+    load = f"PedroVerse.load_effect({effect_id!r})" if effect_id else ""
+    result = subprocess.run([sys.executable, "-c", PROBE.format(load=load)], cwd=ROOT_DIR,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()
+        raise RuntimeError(error[-1] if error else f"exit code {result.returncode}")
+    package_time, total_time = [float(x) for x in result.stdout.split()[-2:]]
+    return package_time, total_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report cold-start import time per effect id.")
+    parser.add_argument("effects", nargs="*", default=EFFECT_IDS, help="effect ids to measure")
+    parser.add_argument("--repeat", type=int, default=3, help="fresh interpreters per effect (best is reported)")
+    parser.add_argument("--budget", type=float, default=None, help="fail if an effect takes longer (seconds)")
+    args = parser.parse_args()
+
+    print(f"{'effect':<14}{'package (s)':>14}{'total (s)':>12}")
+    over_budget = []
+    failed = []
+    for effect_id in [None] + args.effects:
+        name = effect_id or "(package)"
+        try:
+            runs = [measure(effect_id) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f"{name:<14}{'failed: ' + str(e):>26}")
+            failed.append(name)
+            continue
+        package_time = min(r[0] for r in runs)
+        total_time = min(r[1] for r in runs)
+        print(f"{name:<14}{package_time:>14.3f}{total_time:>12.3f}")
+        if args.budget is not None and total_time > args.budget:
+            over_budget.append(name)
+
+    if failed:
+        print(f"Failed to import: {', '.join(failed)}")
+    if over_budget:
+        print(f"Over budget: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
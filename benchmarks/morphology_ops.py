@@ -0,0 +1,75 @@
+"""
+Micro-benchmark of the Paint Transformer stroke morphology.
+
+param2stroke dilates every stroke foreground and erodes every alpha map
+(n_strokes x 3 x 2 * cell x 2 * cell, cell being the layer's cell size). This
+times `morphology.dilation` / `erosion` (max pooling) against the unfold
+reference versions on those shapes, checks the results are identical and
+shows the size of the unfold intermediate the pooling versions avoid.
+
+The default shapes use the render sizes param2stroke produces (64 px on the
+final layers up to 1024 px on coarse ones), with stroke counts chosen so every
+tensor is about 100 MB.
+
+Usage:
+    python benchmarks/morphology_ops.py [--shapes 2048x64 512x128 ...] [--m 1] [--repeat 3]
+"""
+import os
+import sys
+import time
+import argparse
+
+import torch
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+from PedroVerse.neural_paint_transformer import morphology
+
+# n_strokes x render size
+DEFAULT_SHAPES = ["2048x64", "512x128", "128x256", "8x1024"]
+
+
+def best_time(function, x, m, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(x, m)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare max pooling and unfold morphology.")
+    parser.add_argument("--shapes", nargs="+", default=DEFAULT_SHAPES, help="STROKESxSIZE stroke tensors")
+    parser.add_argument("--m", type=int, default=1, help="structuring element radius")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    print(f"{'strokes x size':<16}{'op':<10}{'pool (ms)':>11}{'unfold (ms)':>13}{'speedup':>9}"
+          f"{'unfold tmp (MB)':>17}  same")
+    mismatch = False
+    with torch.no_grad():
+        for text in args.shapes:
+            strokes, size = (int(v) for v in text.lower().split("x"))
+            foreground = torch.rand(strokes, 3, size, size)
+            alphas = (torch.rand(strokes, 3, size, size) > 0.5).float()
+            unfold_bytes = foreground.numel() * foreground.element_size() * (2 * args.m + 1) ** 2
+
+            for name, x, fast, slow in (("dilation", foreground, morphology.dilation, morphology.dilation_slow),
+                                        ("erosion", alphas, morphology.erosion, morphology.erosion_slow)):
+                fast_result, fast_time = best_time(fast, x, args.m, args.repeat)
+                slow_result, slow_time = best_time(slow, x, args.m, args.repeat)
+                same = torch.equal(fast_result, slow_result)
+                mismatch |= not same
+                print(f"{text:<16}{name:<10}{fast_time * 1000:>11.0f}{slow_time * 1000:>13.0f}"
+                      f"{slow_time / fast_time:>8.1f}x{unfold_bytes / 2 ** 20:>17.0f}  {same}")
+
+    if mismatch:
+        print("Pooling and unfold morphology differ.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Work saved by the rectangular Paint Transformer pyramid on texture atlas shapes.
+
+The pyramid used to pad every input to a square of patch_size * 2**K; it now
+pads to the patch grid and each layer only covers the image
+(`inference.pyramid_grids`). For every size this script counts, for the old and
+the new padding:
+
+    patches   - patches pushed through net_g (all layers plus the shifted final pass)
+    Mpx       - stroke pixels rasterized by param2stroke (8 strokes per patch,
+                each rendered on a 2x cell sized square)
+    saved     - old / new rasterized pixels
+
+With --model it also times `execute_paint_transformer` (new padding only, the
+counts show the old cost).
+
+Usage:
+    python benchmarks/paint_transformer_padding.py [--sizes 4096x1024 2049x2049 ...]
+        [--model PATH --brushes VERTICAL HORIZONTAL --time-sizes 512x128 ...]
+"""
+import os
+import sys
+import math
+import time
+import argparse
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+from PedroVerse.neural_paint_transformer.inference import PATCH_SIZE, STROKE_NUM, pyramid_grids
+
+DEFAULT_SIZES = ["4096x4096", "4096x2048", "4096x1024", "2048x512", "2049x2049", "3000x2000", "1920x1080"]
+
+
+def square_grids(h, w, patch_size=PATCH_SIZE):
+    K = max(math.ceil(math.log2(max(h, w) / patch_size)), 0)
+    return [(2 ** layer, 2 ** layer) for layer in range(K + 1)]
+
+
+def work(grids, patch_size=PATCH_SIZE):
+    K = len(grids) - 1
+    patches = pixels = 0
+    for layer, (rows, cols) in enumerate(grids):
+        render_size = 2 * patch_size * 2 ** (K - layer)
+        patches += rows * cols
+        pixels += rows * cols * STROKE_NUM * render_size ** 2
+    rows, cols = grids[-1]
+    # shifted final pass: one more patch per side, rendered at 2 * patch_size
+    patches += (rows + 1) * (cols + 1)
+    pixels += (rows + 1) * (cols + 1) * STROKE_NUM * (2 * patch_size) ** 2
+    return patches, pixels
+
+
+def parse_size(text):
+    width, height = (int(v) for v in text.lower().split("x"))
+    return height, width
+
+
+def time_paint(model_path, brush_paths, height, width):
+    import cv2
+    import numpy as np
+    from PedroVerse.neural_paint_transformer.inference import execute_paint_transformer, get_session
+
+    image = cv2.resize(cv2.imread(os.path.join(ROOT_DIR, "images", "before.png")), (width, height))
+    vertical, horizontal = (cv2.imread(path) for path in brush_paths)
+    session = get_session(model_path)
+    start = time.perf_counter()
+    result = execute_paint_transformer(image, vertical, horizontal, model_path, None, session=session)
+    assert result.shape == image.shape, result.shape
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare square and rectangular Paint Transformer padding.")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="texture sizes as WIDTHxHEIGHT")
+    parser.add_argument("--model", help="Painter weights, to also time real runs")
+    parser.add_argument("--brushes", nargs=2, metavar=("VERTICAL", "HORIZONTAL"), help="brush images for timing")
+    parser.add_argument("--time-sizes", nargs="+", default=["512x128", "512x512"], help="sizes to time with --model")
+    args = parser.parse_args()
+
+    print(f"{'size':<12}{'square pad':>12}{'grid pad':>11}{'patches':>18}{'Mpx':>22}{'saved':>8}")
+    for text in args.sizes:
+        h, w = parse_size(text)
+        old_grids, new_grids = square_grids(h, w), pyramid_grids(h, w)
+        old_patches, old_pixels = work(old_grids)
+        new_patches, new_pixels = work(new_grids)
+        old_pad = f"{old_grids[-1][1] * PATCH_SIZE}x{old_grids[-1][0] * PATCH_SIZE}"
+        new_pad = f"{new_grids[-1][1] * PATCH_SIZE}x{new_grids[-1][0] * PATCH_SIZE}"
+        print(f"{text:<12}{old_pad:>12}{new_pad:>11}{old_patches:>9}->{new_patches:<7}"
+              f"{old_pixels / 1e6:>10.0f}->{new_pixels / 1e6:<9.0f}{old_pixels / new_pixels:>7.1f}x")
+
+    if args.model:
+        if not args.brushes:
+            parser.error("--model needs --brushes")
+        print()
+        for text in args.time_sizes:
+            h, w = parse_size(text)
+            print(f"{text:<12}{time_paint(args.model, args.brushes, h, w):>8.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Palette extraction benchmark for the recolor add-on.
+
+Times `palette.build_palette` (array-backed histogram + k-means) against the
+original pure Python `palette.build_palette_slow` on textures of 2K, 4K and 8K
+and checks that both return the same palette.
+
+Textures are made by upscaling an image (one of the add-on's images by default)
+and adding grain, so they have the colour variety of a real texture.
+
+Usage:
+    python benchmarks/palette_kmeans.py [--sizes 2048 4096 8192] [--k 5] [--image PATH] [--skip-slow]
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+from PIL import Image
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT_DIR, "recolor"))
+
+from util import rgb2lab
+import palette
+
+DEFAULT_IMAGE = os.path.join(ROOT_DIR, "images", "after.png")
+
+
+def make_texture(image_path, size, seed=0):
+    image = Image.open(image_path).convert("RGB").resize((size, size), Image.BICUBIC)
+    rng = np.random.default_rng(seed)
+    pixels = np.asarray(image, dtype=np.float32) + rng.normal(0, 8, (size, size, 3)).astype(np.float32)
+    return Image.fromarray(np.clip(np.round(pixels), 0, 255).astype(np.uint8))
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare array and pure Python palette extraction.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2048, 4096, 8192], help="texture sizes (square)")
+    parser.add_argument("--k", type=int, default=5, help="palette size")
+    parser.add_argument("--image", default=DEFAULT_IMAGE, help="image the textures are made from")
+    parser.add_argument("--skip-slow", action="store_true", help="only time build_palette")
+    args = parser.parse_args()
+
+    print(f"{'size':<8}{'unique':>10}{'array (s)':>12}{'python (s)':>12}{'speedup':>10}  same")
+    mismatch = False
+    for size in args.sizes:
+        image = rgb2lab(make_texture(args.image, size))
+        unique = len(image.getcolors(size * size))
+
+        fast, fast_time = timed(palette.build_palette, image, args.k)
+        if args.skip_slow:
+            print(f"{size:<8}{unique:>10}{fast_time:>12.2f}{'-':>12}{'-':>10}  -")
+            continue
+
+        slow, slow_time = timed(palette.build_palette_slow, image, args.k)
+        same = fast == slow
+        mismatch |= not same
+        print(f"{size:<8}{unique:>10}{fast_time:>12.2f}{slow_time:>12.2f}{slow_time / fast_time:>9.1f}x  {same}")
+
+    if mismatch:
+        print("Palettes differ between build_palette and build_palette_slow.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Accuracy vs speed benchmark for the smoothing stages of the Voronoi watercolor effect.
+
+The bilateral filter and `cv2.xphoto.oilPainting` dominate the cost of
+`apply_voronoi`. `generate_water_color(smoothing_scale=...)` runs them on a
+downscaled copy and upsamples the result ("guided" or "bilinear"). For every
+texture, scale and upsample mode this script times the smoothing and compares
+it with the full resolution result:
+
+    PSNR      - of the smoothed image (higher is closer, inf = identical)
+    grad err  - mean absolute difference of Sobel gradient magnitudes, i.e. how
+                much edge sharpness and placement changed (lower is closer)
+
+Timings include one seeded Voronoi layer, which is cheap and the same for every
+setting. Textures are upscaled to --size so the timings reflect large maps.
+
+Usage:
+    python benchmarks/watercolor_smoothing.py [--size 2048] [--scales 0.5 0.25]
+        [--oil-size 12] [--images PATH ...]
+"""
+import os
+import sys
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+from PedroVerse.water_color import generate_water_color
+
+DEFAULT_IMAGES = [os.path.join(ROOT_DIR, "images", name) for name in ("before.png", "after.png")]
+
+
+def load_texture(path, size):
+    return cv2.resize(cv2.imread(path, cv2.IMREAD_COLOR), (size, size), interpolation=cv2.INTER_CUBIC)
+
+
+def smooth(texture, oil_size, scale, mode):
+    start = time.perf_counter()
+    result = generate_water_color(
+        texture,
+        num_voronoi_patterns=1,
+        oil_paint_size=oil_size,
+        smoothing_scale=scale,
+        upsample_mode=mode,
+        return_steps=True,
+        seed=0,
+    )
+    elapsed = time.perf_counter() - start
+    return dict(result)["03_Oil_Painting_Effect"], elapsed
+
+
+def gradient_magnitude(img):
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY).astype(np.float32)
+    return cv2.magnitude(cv2.Sobel(gray, cv2.CV_32F, 1, 0), cv2.Sobel(gray, cv2.CV_32F, 0, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare reduced resolution smoothing with the full resolution result.")
+    parser.add_argument("--size", type=int, default=2048, help="texture size (square)")
+    parser.add_argument("--scales", type=float, nargs="+", default=[0.5, 0.25], help="smoothing scales to compare")
+    parser.add_argument("--oil-size", type=int, default=12, help="oil painting size at full resolution")
+    parser.add_argument("--images", nargs="+", default=DEFAULT_IMAGES, help="textures to test")
+    args = parser.parse_args()
+
+    print(f"{'texture':<16}{'scale':>7}{'upsample':>10}{'time (s)':>10}{'speedup':>9}{'PSNR':>8}{'grad err':>10}")
+    for path in args.images:
+        name = os.path.basename(path)
+        texture = load_texture(path, args.size)
+        reference, full_time = smooth(texture, args.oil_size, 1.0, "bilinear")
+        reference_grad = gradient_magnitude(reference)
+        print(f"{name:<16}{1.0:>7.2f}{'-':>10}{full_time:>10.2f}{1.0:>8.1f}x{'inf':>8}{0.0:>10.2f}")
+
+        for scale in args.scales:
+            for mode in ("bilinear", "guided"):
+                result, elapsed = smooth(texture, args.oil_size, scale, mode)
+                grad_err = float(np.mean(np.abs(gradient_magnitude(result) - reference_grad)))
+                print(f"{name:<16}{scale:>7.2f}{mode:>10}{elapsed:>10.2f}{full_time / elapsed:>8.1f}x"
+                      f"{cv2.PSNR(reference, result):>8.2f}{grad_err:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
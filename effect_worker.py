@@ -0,0 +1,180 @@
+import os
+import json
+import queue
+import itertools
+import threading
+import subprocess
+from . import globals
+
+# Client for the persistent effect worker (run_effect_subprocess.py --serve).
+# The worker imports torch / tensorflow / pyxelate once and then serves every
+# effect job over a line-delimited JSON protocol on its stdin/stdout.
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(__file__), "run_effect_subprocess.py")
+
+# The first ping has to wait for the heavy imports in the worker.
+STARTUP_TIMEOUT = 300
+PING_TIMEOUT = 10
+# A job still running after this long is treated as a hung worker.
+JOB_TIMEOUT = 3600
+
+
+class EffectWorkerError(RuntimeError):
+    pass
+
+
+class EffectWorkerTimeout(EffectWorkerError):
+    pass
+
+
+class EffectWorker:
+    def __init__(self, python=None, script=WORKER_SCRIPT):
+        self.python = python or globals.PYTHON
+        self.script = script
+        self._process = None
+        self._responses = None
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    # ----------------------------
+    # Process lifecycle
+    # ----------------------------
+
+    def start(self):
+        self._process = subprocess.Popen(
+            [self.python, self.script, "--serve"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=None,  # effect logs go straight to the Blender console
+            text=True,
+            bufsize=1,
+        )
+        self._responses = queue.Queue()
+        reader = threading.Thread(target=self._read_responses,
+                                  args=(self._process, self._responses), daemon=True)
+        reader.start()
+
+        try:
+            self._request({"command": "ping"}, timeout=STARTUP_TIMEOUT)
+        except EffectWorkerError:
+            self.stop()
+            raise
+
+    def stop(self):
+        process = self._process
+        self._process = None
+        if process is None:
+            return
+
+        if process.poll() is None:
+            try:
+                process.stdin.write(json.dumps({"id": None, "command": "shutdown"}) + "\n")
+                process.stdin.flush()
+                process.wait(timeout=5)
+            except (OSError, ValueError, subprocess.TimeoutExpired):
+                process.kill()
+                process.wait()
+
+    def is_alive(self):
+        return self._process is not None and self._process.poll() is None
+
+    def ping(self):
+        if not self.is_alive():
+            return False
+        try:
+            self._request({"command": "ping"}, timeout=PING_TIMEOUT)
+            return True
+        except EffectWorkerError:
+            return False
+
+    def ensure_running(self):
+        """Health-checks the worker and (re)starts it if it died or hangs."""
+        if self.ping():
+            return
+        if self._process is not None:
+            print("[EffectWorker] Worker not responding, restarting...")
+        self.stop()
+        self.start()
+
+    # ----------------------------
+    # Jobs
+    # ----------------------------
+
+    def run(self, effect, input_path, output_path, args=(), timeout=JOB_TIMEOUT):
+        """
+        Runs one effect job on the warm worker and blocks until it finishes.
+        Raises EffectWorkerError if the job fails, the worker dies mid-job or
+        does not answer within timeout seconds. A hung worker is killed; a
+        dead one is restarted on the next call.
+        """
+        with self._lock:
+            self.ensure_running()
+            try:
+                response = self._request({
+                    "command": "run",
+                    "effect": effect,
+                    "input_path": input_path,
+                    "output_path": output_path,
+                    "args": list(args),
+                }, timeout=timeout)
+            except EffectWorkerTimeout:
+                print("[EffectWorker] Job timed out, killing the worker...")
+                self.stop()
+                raise
+        return response["output_path"]
+
+    def _request(self, message, timeout=None):
+        message = dict(message, id=next(self._ids))
+        process = self._process
+        if process is None or process.poll() is not None:
+            raise EffectWorkerError("Effect worker is not running.")
+
+        try:
+            process.stdin.write(json.dumps(message) + "\n")
+            process.stdin.flush()
+        except (OSError, ValueError) as e:
+            raise EffectWorkerError(f"Lost connection to effect worker: {e}")
+
+        while True:
+            try:
+                response = self._responses.get(timeout=timeout)
+            except queue.Empty:
+                raise EffectWorkerTimeout(f"Effect worker did not answer within {timeout}s.")
+
+            if response is None:
+                raise EffectWorkerError(f"Effect worker exited (code {process.poll()}).")
+            # Skip late replies to requests that already timed out.
+            if response.get("id") != message["id"]:
+                continue
+            if not response.get("ok"):
+                raise EffectWorkerError(response.get("error", "Unknown worker error."))
+            return response
+
+    @staticmethod
+    def _read_responses(process, responses):
+        for line in process.stdout:
+            try:
+                response = json.loads(line)
+            except ValueError:
+                continue
+            # Native libraries may print stray lines such as "1" to stdout.
+            if isinstance(response, dict):
+                responses.put(response)
+        responses.put(None)
+
+
+_worker = None
+
+
+def get_worker():
+    global _worker
+    if _worker is None:
+        _worker = EffectWorker()
+    return _worker
+
+
+def shutdown_worker():
+    global _worker
+    if _worker is not None:
+        _worker.stop()
+        _worker = None
@@ -1,8 +1,8 @@
 import bpy
 import os
 import uuid
-import subprocess
 from . import globals
+from .effect_worker import get_worker, EffectWorkerError
 
 class TEXTURE_OT_apply_normal_effect(bpy.types.Operator):
     """Apply effect to normal map and fix color space automatically"""
@@ -90,7 +90,10 @@ class TEXTURE_OT_apply_normal_effect(bpy.types.Operator):
             effect_id = "brush"
             effect_args = [
                 bpy.path.abspath(settings.vertical_brush_path),
-                bpy.path.abspath(settings.horizontal_brush_path)
+                bpy.path.abspath(settings.horizontal_brush_path),
+                str(settings.painter_memory_budget),
+                str(settings.painter_preview_layers),
+                str(int(settings.painter_cache_strokes))
             ]
 
         elif settings.active_option == 'OPTION_3':
@@ -99,7 +102,11 @@ class TEXTURE_OT_apply_normal_effect(bpy.types.Operator):
                 str(settings.num_voronoi_patterns),
                 str(settings.oil_paint_size),
                 str(settings.oil_paint_dyn_ratio),
-                str(int(settings.use_bilateral_filter))
+                str(int(settings.use_bilateral_filter)),
+                "-1",  # random seed
+                str(int(settings.use_voronoi_bank)),
+                str(settings.voronoi_smoothing_scale),
+                settings.voronoi_upsample_mode
             ]
 
         elif settings.active_option == 'OPTION_4':
@@ -114,25 +121,25 @@ class TEXTURE_OT_apply_normal_effect(bpy.types.Operator):
                 effect_args = ["--pointillist"]
             else:
                 effect_args = ["--expressionist"]
+            effect_args.append(str(settings.brushstyle_tile_size))
 
         elif settings.active_option == 'OPTION_5':
             effect_id = "slicstylize"
             effect_args = [
                 str(settings.slic_num_segments),
-                str(settings.slic_compactness)
+                str(settings.slic_compactness),
+                str(settings.slic_max_side)
             ]
 
         if not effect_id:
             self.report({'WARNING'}, "Selected effect not implemented for normals.")
             return {'CANCELLED'}
 
-        python_file = os.path.join(os.path.dirname(__file__), "run_effect_subprocess.py")
-        args = [globals.PYTHON, python_file, effect_id, input_path, output_path] + effect_args + ["--normal"]
-
         try:
-            result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            if result.returncode != 0:
-                self.report({'ERROR'}, f"Effect subprocess failed:\n{result.stderr}")
+            try:
+                get_worker().run(effect_id, input_path, output_path, effect_args + ["--normal"])
+            except EffectWorkerError as e:
+                self.report({'ERROR'}, f"Effect worker failed:\n{e}")
                 return {'CANCELLED'}
 
             new_img = bpy.data.images.load(output_path)
@@ -147,7 +154,7 @@ class TEXTURE_OT_apply_normal_effect(bpy.types.Operator):
             return {'FINISHED'}
 
         except Exception as e:
-            self.report({'ERROR'}, f"Subprocess failed: {e}")
+            self.report({'ERROR'}, f"Failed to apply normal effect: {e}")
             return {'CANCELLED'}
 
 
@@ -166,12 +173,18 @@ def draw_normal_effect_layout(layout, context):
     elif settings.active_option == 'OPTION_2':
         layout.prop(settings, "vertical_brush_path")
         layout.prop(settings, "horizontal_brush_path")
+        layout.prop(settings, "painter_memory_budget")
+        layout.prop(settings, "painter_preview_layers")
+        layout.prop(settings, "painter_cache_strokes")
 
     elif settings.active_option == 'OPTION_3':
         layout.prop(settings, "num_voronoi_patterns")
         layout.prop(settings, "oil_paint_size")
         layout.prop(settings, "oil_paint_dyn_ratio")
         layout.prop(settings, "use_bilateral_filter")
+        layout.prop(settings, "use_voronoi_bank")
+        layout.prop(settings, "voronoi_smoothing_scale")
+        layout.prop(settings, "voronoi_upsample_mode")
 
     elif settings.active_option == 'OPTION_4':
         box = layout.box()
@@ -182,10 +195,12 @@ def draw_normal_effect_layout(layout, context):
         row2 = box.row()
         row2.prop(settings, "brushstyle_colorist")
         row2.prop(settings, "brushstyle_pointillist")
+        box.prop(settings, "brushstyle_tile_size")
 
     elif settings.active_option == 'OPTION_5':
         layout.prop(settings, "slic_num_segments")
         layout.prop(settings, "slic_compactness")
+        layout.prop(settings, "slic_max_side")
 
     layout.operator("texture.apply_normal_effect", text="Apply Normal Effect")
 
@@ -0,0 +1,107 @@
+import numpy as np
+from PIL import Image
+from util import *
+from transfer import apply_sample_color_map
+
+# A recolor result is fully described by its sample color map: the byte LAB
+# output for every point of a level^3 grid over byte LAB space. Saving it lets
+# other textures of the same material set be recolored with a table lookup.
+#
+#   .npy  - the sample color map itself (exact, LAB domain)
+#   .cube - a standard RGB 3D LUT for use outside of the add-on
+
+CUBE_SIZE = 33
+
+
+def save_lut(path, sample_color_map):
+    if path.lower().endswith(".cube"):
+        write_cube(path, lab_lut_to_rgb(sample_color_map))
+    else:
+        np.save(path, np.asarray(sample_color_map, dtype=np.int16))
+
+
+def load_lut(path):
+    """Returns ('lab', sample_color_map) for .npy files or ('rgb', table) for .cube files."""
+    if path.lower().endswith(".cube"):
+        return "rgb", read_cube(path)
+    return "lab", np.load(path).astype(np.int64)
+
+
+def apply_lut(image_rgb, lut):
+    """Recolors an RGB image with a LUT returned by load_lut."""
+    kind, table = lut
+    image_rgb = image_rgb.convert("RGB")
+    if kind == "lab":
+        return lab2rgb(apply_sample_color_map(rgb2lab(image_rgb), table))
+    return apply_rgb_lut(image_rgb, table)
+
+
+def lab_lut_to_rgb(sample_color_map, size=CUBE_SIZE):
+    """
+    Bakes the full recolor pipeline (rgb2lab -> sample color map -> lab2rgb)
+    into a (size, size, size, 3) float RGB table indexed [r, g, b], values in [0, 1].
+    """
+    levels = np.round(np.linspace(0, 255, size)).astype(np.uint8)
+    grid = np.stack(np.meshgrid(levels, levels, levels, indexing='ij'), axis=-1)
+    grid_image = Image.fromarray(grid.reshape(size * size, size, 3))
+    mapped = lab2rgb(apply_sample_color_map(rgb2lab(grid_image), sample_color_map))
+    return np.asarray(mapped, dtype=np.float64).reshape(size, size, size, 3) / 255
+
+
+def apply_rgb_lut(image_rgb, table):
+    """Trilinear lookup of every distinct pixel colour in an RGB table indexed [r, g, b]."""
+    size = table.shape[0]
+    pixels = np.asarray(image_rgb, dtype=np.uint8)[..., :3]
+    packed = (pixels[..., 0].astype(np.int64) << 16) | (pixels[..., 1].astype(np.int64) << 8) | pixels[..., 2]
+    present = np.zeros(1 << 24, dtype=bool)
+    present[packed.ravel()] = True
+    colors_packed = np.flatnonzero(present)
+    colors = np.stack([colors_packed >> 16, (colors_packed >> 8) & 255, colors_packed & 255], axis=-1)
+
+    position = colors / 255 * (size - 1)
+    lower = np.minimum(np.floor(position).astype(np.int64), size - 2)
+    rate = position - lower
+    result = np.zeros(colors.shape, dtype=np.float64)
+    for r in (0, 1):
+        for g in (0, 1):
+            for b in (0, 1):
+                weight = (np.where(r, rate[:, 0], 1 - rate[:, 0])
+                          * np.where(g, rate[:, 1], 1 - rate[:, 1])
+                          * np.where(b, rate[:, 2], 1 - rate[:, 2]))
+                result += table[lower[:, 0] + r, lower[:, 1] + g, lower[:, 2] + b] * weight[:, None]
+
+    color_map = np.zeros((1 << 24, 3), dtype=np.uint8)
+    color_map[colors_packed] = np.clip(np.round(result * 255), 0, 255)
+    return Image.fromarray(color_map[packed])
+
+
+def write_cube(path, table, title="PedroVerse palette recolor"):
+    size = table.shape[0]
+    with open(path, "w") as f:
+        f.write(f'TITLE "{title}"\n')
+        f.write(f"LUT_3D_SIZE {size}\n")
+        f.write("DOMAIN_MIN 0.0 0.0 0.0\n")
+        f.write("DOMAIN_MAX 1.0 1.0 1.0\n")
+        # .cube order: red changes fastest, then green, then blue
+        for row in table.transpose(2, 1, 0, 3).reshape(-1, 3):
+            f.write(f"{row[0]:.6f} {row[1]:.6f} {row[2]:.6f}\n")
+
+
+def read_cube(path):
+    size = None
+    rows = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            key = line.split()[0]
+            if key == "LUT_3D_SIZE":
+                size = int(line.split()[1])
+            elif key[0].isdigit() or key[0] in "-.":
+                rows.append([float(x) for x in line.split()[:3]])
+            # TITLE / DOMAIN_* lines are ignored; the domain is assumed to be [0, 1]
+
+    if size is None or len(rows) != size ** 3:
+        raise ValueError(f"Not a valid 3D .cube LUT: {path}")
+    return np.array(rows, dtype=np.float64).reshape(size, size, size, 3).transpose(2, 1, 0, 3)
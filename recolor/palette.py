@@ -2,6 +2,7 @@
 import random
 import itertools
 import math
+import numpy as np
 from PIL import Image
 from util import *
 
@@ -87,7 +88,98 @@ def init_means(bins, k):
 
     return result
 
+def simple_bins_array(image, size=16, chunk=1 << 22):
+    """
+    Array version of getcolors + simple_bins. Returns the mean colours (B, 3) and
+    pixel counts (B,) of the non-empty bins, in the same order as simple_bins.
+    Pixels are binned directly, chunk pixels at a time; the sums are of integers,
+    so they match the per-colour sums of simple_bins exactly.
+    """
+    level = 256//size
+    raw = np.asarray(image).reshape(-1, 3)
+    bin_size = np.zeros(size**3, dtype=np.int64)
+    bin_sum = np.zeros((size**3, 3), dtype=np.float64)
+    for start in range(0, len(raw), chunk):
+        # PIL stores a and b as signed bytes; flipping their sign bits gives the
+        # same colours getpixel / getcolors report.
+        colors = raw[start:start + chunk] ^ np.array([0, 0x80, 0x80], dtype=np.uint8)
+        index = colors // level
+        flat = (index[:, 0].astype(np.intp) * size + index[:, 1]) * size + index[:, 2]
+        bin_size += np.bincount(flat, minlength=size**3)
+        for i in range(3):
+            bin_sum[:, i] += np.bincount(flat, weights=colors[:, i], minlength=size**3)
+
+    nonzero = np.flatnonzero(bin_size)
+    return bin_sum[nonzero] / bin_size[nonzero, None], bin_size[nonzero]
+
+def _distances(colors, means):
+    diff = colors[:, None, :] - means[None, :, :]
+    return np.sqrt(diff[..., 0]**2 + diff[..., 1]**2 + diff[..., 2]**2)
+
+def init_means_array(colors, counts, k):
+    def attenuation(target):
+        return 1 - np.exp(((_distances(colors, target[None])[:, 0]/80)**2) * -1)
+
+    weights = counts.astype(np.float64)
+    chosen = np.zeros(len(colors), dtype=bool)
+
+    result = []
+    for _ in range(k):
+        #select the heaviest remaining colour (ties broken by colour, as list.sort does)
+        order = np.lexsort((colors[:, 2], colors[:, 1], colors[:, 0], weights))
+        remaining = order[~chosen[order]]
+        if len(remaining) > 0:
+            chosen[remaining[-1]] = True
+            result.append(colors[remaining[-1]])
+
+        weights = weights * attenuation(result[-1])
+
+    return [tuple(color.tolist()) for color in result]
+
+def k_means_array(colors, counts, means, k, maxiter=1000, black=True):
+    means = [tuple(mean) for mean in means]
+    if black:
+        means.append((0, 128, 128))
+    means = np.array(means, dtype=np.float64)
+
+    record = np.full(len(colors), -1)
+    for _ in range(maxiter):
+        #assign
+        cluster = np.argmin(_distances(colors, means), axis=1)
+        done = np.array_equal(cluster, record)
+        record = cluster
+
+        cluster_size = np.bincount(cluster, weights=counts, minlength=len(means))
+        cluster_sum = np.stack([np.bincount(cluster, weights=colors[:, i] * counts, minlength=len(means))
+                                for i in range(3)], axis=-1)
+
+        #update
+        for i in range(k):
+            if cluster_size[i] > 0:
+                means[i] = cluster_sum[i] / cluster_size[i]
+
+        if done:
+            break
+
+    return [tuple(mean) for mean in means[:k].tolist()]
+
 def build_palette(image, k=5, random_init=False, black=True):
+    #build bins
+    colors, counts = simple_bins_array(image)
+
+    #init means
+    if random_init:
+        init = random.sample([tuple(color) for color in colors.tolist()], k)
+    else:
+        init = init_means_array(colors, counts, k)
+
+    #k-means
+    means = k_means_array(colors, counts, init, k, black=black)
+    means.sort(reverse=True)
+    colors = [tuple([int(x) for x in color]) for color in means]
+    return colors
+
+def build_palette_slow(image, k=5, random_init=False, black=True):
     #get colors
     colors = image.getcolors(image.width * image.height)
 
@@ -109,14 +201,9 @@ def build_palette(image, k=5, random_init=False, black=True):
     colors = [tuple([int(x) for x in color]) for color in means]
     return colors
 
-def draw_color(color, size=100):
-    color = RegularRGB(LABtoRGB(RegularLAB(color)))
-    return Image.new('RGB', (size, size), color)
-
 def draw_palette(palette, size=100, horizontal=True):
-    images = []
-    for color in palette:
-        images.append(draw_color(color, size))
+    colors = RegularRGB_array(LABtoRGB_array(RegularLAB_array(palette)))
+    images = [Image.new('RGB', (size, size), tuple(color)) for color in colors.tolist()]
     if horizontal:
         return h_merge(images)
     else:
@@ -13,6 +13,7 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from palette import *
 from util import *
 from transfer import *
+from lut import save_lut, load_lut, apply_lut
 
 
 
@@ -23,7 +24,7 @@ def getPalettes(numpy_image, save_filepath, num):
     image_lab = rgb2lab(image_rgb)
     palette = build_palette(image_lab, num)
 
-    recolorPalette = [RegularRGB(LABtoRGB(RegularLAB(c))) for c in palette]
+    recolorPalette = RegularRGB_array(LABtoRGB_array(RegularLAB_array(palette))).tolist()
 
     for i in range(len(palette)):
         palette[i] = [*palette[i], 1.0]
@@ -35,11 +36,14 @@ def getPalettes(numpy_image, save_filepath, num):
     
     print(json.dumps(output))
 
-def setPalette(image_filepath, old_palette, new_palette):
+def setPalette(image_filepath, old_palette, new_palette, lut_paths=()):
     image_rgb = Image.open(image_filepath)
     image_lab = rgb2lab(image_rgb)
     
-    new_image = image_transfer(image_lab, old_palette, new_palette, sample_level=10, luminance_flag=False)
+    new_image, sample_color_map = image_transfer(image_lab, old_palette, new_palette, sample_level=10,
+                                                 luminance_flag=False, return_sample_color_map=True)
+    for lut_path in lut_paths:
+        save_lut(lut_path, sample_color_map)
     return new_image
 
 def rgbCol2lab(old_color):
@@ -59,19 +63,29 @@ def recolor(imageType, recolorfilepath, dirpath, recolorpalette, originalpalette
         lab_col = rgbCol2lab(col)
         new_palette.append([*lab_col[0:3], recolorpalette[i][3]])
 
-    new_image = setPalette(recolorfilepath, old_palette=originalpalette, new_palette=new_palette)
-
-    filename = "default.png"
+    filename = "default"
     filepath = dirpath #os.path.dirname(bpy.data.filepath) + "/new_palette" + "/"
 
     if(imageType != 0):
-        filename = "texture.png"
-    
-    image_path = dirpath + filename
+        filename = "texture"
+
+    # The LUTs let other textures of the same material set be recolored with applyLUT.
+    lut_paths = [dirpath + filename + "_lut.npy", dirpath + filename + ".cube"]
+    new_image = setPalette(recolorfilepath, old_palette=originalpalette, new_palette=new_palette, lut_paths=lut_paths)
+
+    image_path = dirpath + filename + ".png"
     saveImage(new_image, image_path)
 
     print(image_path)
 
+def applyLUT(lut_path, image_filepath, output_path):
+    image_rgb = Image.open(image_filepath)
+    new_image = apply_lut(image_rgb, load_lut(lut_path))
+    temp = cv2.cvtColor(numpy.array(new_image), cv2.COLOR_RGB2BGR)
+    cv2.imwrite(output_path, temp)
+
+    print(output_path)
+
 if __name__=="__main__":
     function = sys.argv[1]
 
@@ -91,4 +105,11 @@ if __name__=="__main__":
 
         recolor(imageType, recolorfilepath, dirpath, recolorpalette, originalpalette)
 
+    elif(function == "applyLUT"):
+        lut_path = sys.argv[2]
+        image_filepath = sys.argv[3]
+        output_path = sys.argv[4]
+
+        applyLUT(lut_path, image_filepath, output_path)
+
     
\ No newline at end of file
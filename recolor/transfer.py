@@ -1,11 +1,9 @@
 # code taken from https://github.com/rupareddy5/Palette-based-photo-recoloring?tab=readme-ov-file
 import math
 import itertools
-import time
+import numpy
 import numpy.linalg
 from util import *
-from concurrent.futures import ThreadPoolExecutor
-import multiprocessing
 
 def modify_luminance(original_p, index, new_l):
     modified_p = original_p[:]
@@ -91,6 +89,55 @@ def single_color_transfer(color, original_c, modified_c):
 
     return result
 
+def single_color_transfer_batch(colors, original_c, modified_c):
+    """
+    single_color_transfer for an (N, 3) array of LAB colours at once: the boundary
+    bisection runs on all colours together, with a validity mask per step.
+    """
+    def get_boundary(origin, direction, k_min, k_max, iters=20):
+        start = origin + direction * k_min
+        end = origin + direction * k_max
+        for _ in range(iters):
+            mid = (start + end) / 2
+            valid = is_valid(mid)[..., None]
+            start = numpy.where(valid, mid, start)
+            end = numpy.where(valid, end, mid)
+        return (start + end) / 2
+
+    def is_valid(lab):
+        valid = ValidLAB_array(lab)
+        valid[valid] = ValidRGB_array(LABtoRGB_array(lab[valid]))
+        return valid
+
+    def length(v):
+        return numpy.sqrt(v[..., 0]**2 + v[..., 1]**2 + v[..., 2]**2)
+
+    #init
+    colors = numpy.asarray(colors, dtype=numpy.float64)
+    original_c = numpy.asarray(original_c, dtype=numpy.float64)
+    modified_c = numpy.asarray(modified_c, dtype=numpy.float64)
+    offset = modified_c - original_c
+
+    #get boundary
+    c_boundary_len = length(get_boundary(original_c[None], offset[None], 1, 255)[0] - original_c)
+    inside = is_valid(colors + offset)
+    boundary = numpy.empty_like(colors)
+    boundary[inside] = get_boundary(colors[inside], offset, 1, 255)
+    boundary[~inside] = get_boundary(modified_c, colors[~inside] - original_c, 0, 1)
+
+    #transfer
+    direction = boundary - colors
+    direction_len = length(direction)
+    offset_len = length(offset)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        scale = numpy.where(direction_len < c_boundary_len,
+                            offset_len / c_boundary_len,
+                            offset_len / direction_len)
+    result = colors + direction * scale[:, None]
+    result[direction_len == 0] = colors[direction_len == 0]
+
+    return result
+
 def calc_weights(color, original_p):
     def mean_distance(original_p):
         dists = []
@@ -127,6 +174,56 @@ def calc_weights(color, original_p):
 
     return weights
 
+class PaletteWeights:
+    """
+    RBF weights of LAB colours with respect to a palette, as in calc_weights.
+    Everything that depends only on the palette (mean distance, inverse of phi)
+    is computed once here instead of once per colour.
+    """
+
+    def __init__(self, original_p):
+        self.original_p = [tuple(c[:3]) for c in original_p]
+
+        dists = []
+        for a, b in itertools.combinations(self.original_p, 2):
+            dists.append(distance(a, b))
+        self.mean_distance = sum(dists) / len(dists)
+
+        matrix = []
+        for i in range(len(self.original_p)):
+            temp = []
+            for j in range(len(self.original_p)):
+                temp.append(self.gaussian(distance(self.original_p[j], self.original_p[i])))
+            matrix.append(temp)
+        self.lamb = numpy.linalg.inv(numpy.array(matrix))
+
+    def gaussian(self, r):
+        return math.exp(((r/self.mean_distance)**2) * -0.5)
+
+    def __call__(self, colors):
+        """
+        Returns the (N, k) normalized weights of an (N, 3) array of colours.
+        phi uses math.exp and the scalar distance, and the sums run in the same
+        order as calc_weights, so the weights are bit-identical to it (numpy's
+        exp, sqrt and matrix product round differently, which flips truncated
+        LUT entries).
+        """
+        phi = numpy.array([[self.gaussian(distance(color, p)) for p in self.original_p]
+                           for color in numpy.asarray(colors, dtype=numpy.float64).tolist()])
+        phi = phi.reshape(-1, len(self.original_p))
+
+        #weights[i] = sum over j of lamb[i][j] * phi[j], accumulated left to right
+        weights = numpy.zeros_like(phi)
+        for j in range(len(self.original_p)):
+            weights = weights + self.lamb[:, j][None, :] * phi[:, j:j+1]
+
+        #normalize weights
+        weights = numpy.maximum(weights, 0)
+        w_sum = numpy.zeros(len(weights))
+        for i in range(len(self.original_p)):
+            w_sum = w_sum + weights[:, i]
+        return weights / w_sum[:, None]
+
 def multiple_color_transfer(color, original_p, modified_p):
     #single color transfer
     color_st = []
@@ -143,6 +240,21 @@ def multiple_color_transfer(color, original_p, modified_p):
 
     return color_mt.data
 
+def multiple_color_transfer_batch(colors, original_p, modified_p, palette_weights=None):
+    colors = numpy.asarray(colors, dtype=numpy.float64)
+
+    #get weights
+    if palette_weights is None:
+        palette_weights = PaletteWeights(original_p)
+    weights = palette_weights(colors)
+
+    #calc result
+    color_mt = numpy.zeros_like(colors)
+    for i in range(len(original_p)):
+        color_mt = color_mt + single_color_transfer_batch(colors, original_p[i], modified_p[i]) * weights[:, i:i+1]
+
+    return color_mt
+
 def RGB_sample_color(size=16):
     assert(size >= 2)
 
@@ -181,68 +293,73 @@ def trilinear_interpolation(target, corners, sample_color_map):
 
     return result
 
-def luminance_transfer_mt(args):
-    return luminance_transfer(*args)
-
-def multiple_color_transfer_mt(args):
-    return multiple_color_transfer(*args)
-
-def trilinear_interpolation_mt(args):
-    return trilinear_interpolation(*args)
-
-def image_transfer(image, original_p, modified_p, sample_level=16, luminance_flag=False):
-    t = time.time()
+def build_sample_color_map(original_p, modified_p, sample_level=16, luminance_flag=False):
+    """
+    Transfers every colour of a sample_level^3 grid over byte LAB space and returns
+    the result as a (sample_level, sample_level, sample_level, 3) int array of byte
+    LAB colours. original_p and modified_p are regular LAB palettes.
+    """
+    levels = numpy.arange(sample_level) * (255/(sample_level-1))
+    grid = numpy.stack(numpy.meshgrid(levels, levels, levels, indexing='ij'), axis=-1).reshape(-1, 3)
+    sample_colors = numpy.stack([grid[:, 0] / 255 * 100, grid[:, 1] - 128, grid[:, 2] - 128], axis=-1)
+
+    palette_weights = PaletteWeights(original_p)
+    lab = multiple_color_transfer_batch(sample_colors, original_p, modified_p, palette_weights)
+    if luminance_flag:
+        lab[:, 0] = [luminance_transfer(color, original_p, modified_p) for color in sample_colors.tolist()]
+
+    byte_lab = numpy.stack([lab[:, 0] / 100 * 255, lab[:, 1] + 128, lab[:, 2] + 128], axis=-1)
+    return numpy.trunc(byte_lab).astype(numpy.int64).reshape(sample_level, sample_level, sample_level, 3)
+
+def apply_sample_color_map(image, sample_color_map):
+    """
+    Maps every pixel of a byte LAB image through the sample colour map by
+    trilinear interpolation between its 8 surrounding grid samples.
+    Each distinct colour is interpolated once and pixels are filled by indexing.
+    """
+    sample_level = sample_color_map.shape[0]
+    level = 255 / (sample_level - 1)
+    levels = numpy.arange(sample_level) * (255/(sample_level-1))
+
+    pixels = lab_image_to_array(image)
+    packed = (pixels[..., 0].astype(numpy.int64) << 16) | (pixels[..., 1].astype(numpy.int64) << 8) | pixels[..., 2]
+    present = numpy.zeros(1 << 24, dtype=bool)
+    present[packed.ravel()] = True
+    colors_packed = numpy.flatnonzero(present)
+    colors = numpy.stack([colors_packed >> 16, (colors_packed >> 8) & 255, colors_packed & 255], axis=-1)
+
+    #nearest grid samples and interpolation rates per channel
+    index = colors / level
+    lower = numpy.minimum(numpy.floor(index).astype(numpy.int64), sample_level - 1)
+    upper = numpy.minimum(numpy.ceil(index).astype(numpy.int64), sample_level - 1)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        temp = (colors - levels[lower]) / (levels[upper] - levels[lower])
+    temp[lower == upper] = 0
+    rates = (1 - temp, temp)
+    corners = (lower, upper)
+
+    #accumulate the 8 corners in the same order as trilinear_interpolation
+    result = numpy.zeros(colors.shape, dtype=numpy.float64)
+    for r, g, b in itertools.product((0, 1), repeat=3):
+        rate = rates[r][:, 0] * rates[g][:, 1] * rates[b][:, 2]
+        sc = sample_color_map[corners[r][:, 0], corners[g][:, 1], corners[b][:, 2]]
+        result = result + sc * rate[:, None]
+
+    color_map = numpy.zeros((1 << 24, 3), dtype=numpy.uint8)
+    color_map[colors_packed] = numpy.clip(numpy.trunc(result), 0, 255)
+
+    return array_to_lab_image(color_map[packed])
+
+def image_transfer(image, original_p, modified_p, sample_level=16, luminance_flag=False, return_sample_color_map=False):
     #init
     original_p = [RegularLAB(c) for c in original_p]
     modified_p = [RegularLAB(c) for c in modified_p]
-    level = 255 / (sample_level - 1)
-    levels = [i * (255/(sample_level-1)) for i in range(sample_level)]
 
     #build sample color map
-    t2 = time.time()
-    sample_color_map = {}
-    sample_colors = RGB_sample_color(sample_level)
-
-    args = []
-    for color in sample_colors:
-        args.append((RegularLAB(color), original_p, modified_p))
-
-    with ThreadPoolExecutor(max_workers=multiprocessing.cpu_count() - 1) as executor:
-        if luminance_flag:
-            l = list(executor.map(luminance_transfer_mt, args))
-            lab = list(executor.map(multiple_color_transfer_mt, args))
-
-            for i in range(len(sample_colors)):
-                sample_color_map[sample_colors[i]] = ByteLAB((l[i], *lab[i][-2:]))
-        else:
-            lab = list(executor.map(multiple_color_transfer_mt, args))
-
-            for i in range(len(sample_colors)):
-                sample_color_map[sample_colors[i]] = ByteLAB(lab[i])
-
-    t2 = time.time()
-
-    #build color map
-    color_map = {}
-    colors = image.getcolors(image.width * image.height)
-
-    args = []
-    for _, color in colors:
-        nc = nearest_color(color, level, levels)
-        args.append((color, nc, sample_color_map))
-    with ThreadPoolExecutor(max_workers=multiprocessing.cpu_count() - 1) as executor:
-        inter_result = list(executor.map(trilinear_interpolation_mt, args))
-
-    for i in range(len(colors)):
-        color_map[colors[i][1]] = tuple([int(x) for x in inter_result[i]])
-    t2 = time.time()
+    sample_color_map = build_sample_color_map(original_p, modified_p, sample_level, luminance_flag)
 
     #transfer image
-    result = Image.new('LAB', image.size)
-    result_pixels = result.load()
-    image_pixels = image.load()
-    for i in range(image.width):
-        for j in range(image.height):
-            result_pixels[i, j] = color_map[image_pixels[i, j]]
-
+    result = apply_sample_color_map(image, sample_color_map)
+    if return_sample_color_map:
+        return result, sample_color_map
     return result
@@ -1,4 +1,5 @@
 # code taken from https://github.com/rupareddy5/Palette-based-photo-recoloring?tab=readme-ov-file
+import numpy as np
 from PIL import Image, ImageCms
 
 def rgb2lab(image):
@@ -12,20 +13,24 @@ def lab2rgb(image):
     return ImageCms.profileToProfile(image, LAB_p, RGB_p, outputMode='RGB')
 
 def rgb2lab_slow(image):
-    result = Image.new('LAB', image.size)
-    result_pixels = result.load()
-    for i in range(image.width):
-        for j in range(image.height):
-            result_pixels[i, j] = ByteLAB(RGBtoLAB(image.getpixel((i, j))[:3]))
-    return result
+    pixels = np.asarray(image.convert('RGB'), dtype=np.float64)
+    return array_to_lab_image(ByteLAB_array(RGBtoLAB_array(pixels)))
 
 def lab2rgb_slow(image):
-    result = Image.new('RGB', image.size)
-    result_pixels = result.load()
-    for i in range(image.width):
-        for j in range(image.height):
-            result_pixels[i, j] = RegularRGB(LABtoRGB(RegularLAB(image.getpixel((i, j)))))
-    return result
+    pixels = lab_image_to_array(image)
+    return Image.fromarray(RegularRGB_array(LABtoRGB_array(RegularLAB_array(pixels))).astype(np.uint8))
+
+def lab_image_to_array(image):
+    # PIL keeps the a/b channels of 'LAB' images as signed bytes; flip them to the
+    # 0..255 byte LAB values getpixel() returns.
+    pixels = np.array(image, dtype=np.uint8)[..., :3]
+    pixels[..., 1:] ^= 128
+    return pixels
+
+def array_to_lab_image(pixels):
+    pixels = np.array(pixels, dtype=np.uint8)
+    pixels[..., 1:] ^= 128
+    return Image.frombytes('LAB', (pixels.shape[1], pixels.shape[0]), pixels.tobytes())
 
 def LABtoXYZ(LAB):
     def f(n):
@@ -97,6 +102,84 @@ def ByteLAB(LAB):
 def RegularRGB(RGB):
     return tuple([int(max(0, min(x, 255))) for x in RGB])
 
+# ndarray versions of the conversions above, broadcasting over (..., 3) arrays.
+# They follow the scalar formulas operation for operation so results agree.
+
+def LABtoXYZ_array(LAB):
+    def f(n):
+        return np.where(n > 6/29, n**3, 3 * ((6/29)**2) * (n - 4/29))
+
+    LAB = np.asarray(LAB, dtype=np.float64)
+    L, a, b = LAB[..., 0], LAB[..., 1], LAB[..., 2]
+    X = 95.047 * f((L+16)/116 + a/500)
+    Y = 100.000 * f((L+16)/116)
+    Z = 108.883 * f((L+16)/116  - b/200)
+    return np.stack([X, Y, Z], axis=-1)
+
+def XYZtoRGB_array(XYZ):
+    def f(n):
+        # clamp before the power so the unused branch never sees negative input
+        return np.where(n <= 0.0031308, n*12.92, (np.maximum(n, 0.0031308)**(1/2.4)) * 1.055 - 0.055)
+
+    XYZ = np.asarray(XYZ, dtype=np.float64)
+    X, Y, Z = XYZ[..., 0]/100, XYZ[..., 1]/100, XYZ[..., 2]/100
+    R = f(3.2406*X + -1.5372*Y + -0.4986*Z) * 255
+    G = f(-0.9689*X + 1.8758*Y + 0.0415*Z) * 255
+    B = f(0.0557*X + -0.2040*Y + 1.0570*Z) * 255
+    return np.stack([R, G, B], axis=-1)
+
+def LABtoRGB_array(LAB):
+    return XYZtoRGB_array(LABtoXYZ_array(LAB))
+
+def RGBtoXYZ_array(RGB):
+    def f(n):
+        return np.where(n <= 0.04045, n/12.92, ((n+0.055)/1.055)**2.4)
+
+    RGB = np.asarray(RGB, dtype=np.float64)
+    R, G, B = f(RGB[..., 0]/255), f(RGB[..., 1]/255), f(RGB[..., 2]/255)
+    X = (0.4124*R + 0.3576*G + 0.1805*B) * 100
+    Y = (0.2126*R + 0.7152*G + 0.0722*B) * 100
+    Z = (0.0193*R + 0.1192*G + 0.9505*B) * 100
+    return np.stack([X, Y, Z], axis=-1)
+
+def XYZtoLAB_array(XYZ):
+    def f(n):
+        # clamp before the power so the unused branch never sees negative input
+        return np.where(n > (6/29)**3, np.maximum(n, (6/29)**3)**(1/3), (n / (3*((6/29)**2))) + (4/29))
+
+    XYZ = np.asarray(XYZ, dtype=np.float64)
+    X = XYZ[..., 0] / 95.047
+    Y = XYZ[..., 1] / 100.000
+    Z = XYZ[..., 2] / 108.883
+
+    L = 116*f(Y) - 16
+    a = 500 * (f(X) - f(Y))
+    b = 200 * (f(Y) - f(Z))
+    return np.stack([L, a, b], axis=-1)
+
+def RGBtoLAB_array(RGB):
+    return XYZtoLAB_array(RGBtoXYZ_array(RGB))
+
+def ValidRGB_array(RGB):
+    RGB = np.asarray(RGB)
+    return np.all((RGB >= 0) & (RGB <= 255), axis=-1)
+
+def ValidLAB_array(LAB):
+    LAB = np.asarray(LAB)
+    L, a, b = LAB[..., 0], LAB[..., 1], LAB[..., 2]
+    return (0 <= L) & (L <= 100) & (-128 <= a) & (a <= 127) & (-128 <= b) & (b <= 127)
+
+def RegularLAB_array(LAB):
+    LAB = np.asarray(LAB, dtype=np.float64)
+    return np.stack([LAB[..., 0] / 255 * 100, LAB[..., 1] - 128, LAB[..., 2] - 128], axis=-1)
+
+def ByteLAB_array(LAB):
+    LAB = np.asarray(LAB, dtype=np.float64)
+    return np.trunc(np.stack([LAB[..., 0] / 100 * 255, LAB[..., 1] + 128, LAB[..., 2] + 128], axis=-1)).astype(np.int64)
+
+def RegularRGB_array(RGB):
+    return np.trunc(np.clip(np.asarray(RGB, dtype=np.float64), 0, 255)).astype(np.int64)
+
 def distance(color_a, color_b):
     return (sum([(a-b)**2 for a, b in zip(color_a, color_b)]))**0.5
 
@@ -1,5 +1,7 @@
 import sys
 import os
+import json
+import traceback
 import cv2
 
 # Import real effect implementations
@@ -10,12 +12,12 @@ from PedroVerse import apply_brushstyle
 from PedroVerse import apply_slic
 from PedroVerse import apply_uv_mask_from_arrays
 from PedroVerse import edge_detection, apply_bilateral_filter
+from texture_transfer.texture_subprocess import stylize
 
 
 def load_image(path):
     if not os.path.exists(path):
-        print(f"[ERROR] Input image not found: {path}")
-        sys.exit(1)
+        raise FileNotFoundError(f"Input image not found: {path}")
     return cv2.imread(path)
 
 
@@ -32,11 +34,16 @@ def run_pixelate(args):
 
 def run_brush(args):
     input_path, vertical_path, horizontal_path = args[0], args[1], args[2]
-    print(f"[Brush] input={input_path}, vertical={vertical_path}, horizontal={horizontal_path}")
+    memory_budget_mb = int(args[3]) if len(args) > 3 and int(args[3]) > 0 else None  # 0: unlimited
+    preview_layers = int(args[4]) if len(args) > 4 else 0  # 0: paint every layer
+    max_layer = preview_layers - 1 if preview_layers > 0 else None
+    cache_strokes = bool(int(args[5])) if len(args) > 5 else False
+    print(f"[Brush] input={input_path}, vertical={vertical_path}, horizontal={horizontal_path}, memory_budget_mb={memory_budget_mb}, max_layer={max_layer}, cache_strokes={cache_strokes}")
     image = load_image(input_path)
     vertical_brush = load_image(vertical_path)
     horizontal_brush = load_image(horizontal_path)
-    return apply_brush_strokes(image, vertical_brush, horizontal_brush)
+    return apply_brush_strokes(image, vertical_brush, horizontal_brush, memory_budget_mb=memory_budget_mb,
+                               max_layer=max_layer, cache_strokes=cache_strokes)
 
 
 def run_voronoi(args):
@@ -47,37 +54,58 @@ def run_voronoi(args):
     oil_size = int(args[2])
     dyn_ratio = int(args[3])
     bilateral = bool(int(args[4]))
+    seed = int(args[5]) if len(args) > 5 and int(args[5]) >= 0 else None  # negative: random
+    use_bank = bool(int(args[6])) if len(args) > 6 else False
+    smoothing_scale = float(args[7]) if len(args) > 7 else 1.0
+    upsample_mode = args[8] if len(args) > 8 else "bilinear"
 
-    print(f"[Voronoi] image={input_path}, patterns={num_patterns}, size={oil_size}, dyn={dyn_ratio}, bilateral={bilateral}")
+    print(f"[Voronoi] image={input_path}, patterns={num_patterns}, size={oil_size}, dyn={dyn_ratio}, bilateral={bilateral}, seed={seed}, bank={use_bank}, smoothing_scale={smoothing_scale}, upsample={upsample_mode}")
     return apply_voronoi(
         image,
         num_voronoi_patterns=num_patterns,
         oil_paint_size=oil_size,
         oil_paint_dyn_ratio=dyn_ratio,
-        use_bilateral_filter=bilateral
+        use_bilateral_filter=bilateral,
+        seed=seed,
+        use_pattern_bank=use_bank,
+        smoothing_scale=smoothing_scale,
+        upsample_mode=upsample_mode
     )
 
 
 def run_brushstyle(args):
     input_path = args[0]
     style_flag = args[1] if len(args) > 1 else "--expressionist"
-    print(f"[BrushStyle] input={input_path}, style={style_flag}")
-    return apply_brushstyle(input_path, output_path=None, style_flag=style_flag)
+    tile_size = int(args[2]) if len(args) > 2 else 0
+    workers = int(args[3]) if len(args) > 3 else 0
+    print(f"[BrushStyle] input={input_path}, style={style_flag}, tile_size={tile_size}, workers={workers}")
+    return apply_brushstyle(input_path, output_path=None, style_flag=style_flag,
+                            tile_size=tile_size or None, workers=workers or None)
 
 
 def run_slicstylize(args):
     input_path = args[0]
     num_segments = int(args[1]) if len(args) > 1 else 300
     compactness = int(args[2]) if len(args) > 2 else 50
+    max_side = int(args[3]) if len(args) > 3 else 0
 
-    print(f"[SLIC Stylize] input={input_path}, segments={num_segments}, compactness={compactness}")
+    print(f"[SLIC Stylize] input={input_path}, segments={num_segments}, compactness={compactness}, max_side={max_side}")
     image = load_image(input_path)
     image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    result_rgb = apply_slic(image_rgb, num_segments=num_segments, compactness=compactness)
+    result_rgb = apply_slic(image_rgb, num_segments=num_segments, compactness=compactness, max_side=max_side or None)
     result_bgr = cv2.cvtColor(result_rgb, cv2.COLOR_RGB2BGR)
     return result_bgr
 
 
+def run_texture(args):
+    input_path, blending_ratio, content_image_size = args[0], float(args[1]), int(args[2])
+    style_predict_path, style_transform_path, style_path = args[3], args[4], args[5]
+    print(f"[Texture] input={input_path}, style={style_path}, blending_ratio={blending_ratio}, size={content_image_size}")
+    result_rgb = stylize(input_path, blending_ratio, content_image_size,
+                         style_predict_path, style_transform_path, style_path)
+    return cv2.cvtColor(result_rgb, cv2.COLOR_RGB2BGR)
+
+
 def apply_optional_normal_mask(result_img, input_path, is_normal_flag, effect):
     if is_normal_flag and effect != "pixelate":
         reference_img = load_image(input_path)
@@ -88,9 +116,106 @@ def apply_optional_normal_mask(result_img, input_path, is_normal_flag, effect):
     return result_img
 
 
+EFFECT_HANDLERS = {
+    "pixelate": run_pixelate,
+    "brush": run_brush,
+    "voronoi": run_voronoi,
+    "brushstyle": run_brushstyle,
+    "slicstylize": run_slicstylize,
+    "texture": run_texture,
+}
+
+
+def run_effect(effect, input_path, output_path, args):
+    """
+    Runs one effect job end to end: dispatches on the effect id, applies the
+    UV mask for normal maps and writes the result to output_path.
+    Shared by the one-shot CLI and the persistent worker (--serve).
+    """
+    args = list(args)
+
+    # Detect --normal flag and remove it from args
+    is_normal_flag = False
+    if "--normal" in args:
+        is_normal_flag = True
+        args.remove("--normal")
+
+    if effect not in EFFECT_HANDLERS:
+        raise ValueError(f"Unknown effect: {effect}")
+
+    result = EFFECT_HANDLERS[effect]([input_path] + args)
+
+    # Post-process if it's a normal map (skip for pixelate)
+    result = apply_optional_normal_mask(result, input_path, is_normal_flag, effect)
+
+    save_image(result, output_path)
+    print(f"[Subprocess] Image saved to {output_path}")
+    return output_path
+
+
+def serve():
+    """
+    Long-lived worker mode. Reads one JSON request per line from stdin and
+    answers each with one JSON line on stdout:
+
+        {"id": 1, "command": "ping"}
+        {"id": 2, "command": "run", "effect": "voronoi", "input_path": ..., "output_path": ..., "args": [...]}
+        {"id": 3, "command": "shutdown"}
+
+    Effect logging is redirected to stderr so it never interleaves with replies.
+    """
+    protocol_out = sys.stdout
+    sys.stdout = sys.stderr
+
+    def reply(message):
+        protocol_out.write(json.dumps(message) + "\n")
+        protocol_out.flush()
+
+    print(f"[Worker] Ready (pid={os.getpid()})")
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            reply({"id": None, "ok": False, "error": f"Malformed request: {e}"})
+            continue
+
+        job_id = request.get("id")
+        command = request.get("command")
+
+        if command == "ping":
+            reply({"id": job_id, "ok": True, "pid": os.getpid()})
+
+        elif command == "shutdown":
+            reply({"id": job_id, "ok": True})
+            break
+
+        elif command == "run":
+            print(f"\n[Worker] Job {job_id}: {request.get('effect')} {request.get('args', [])}")
+            try:
+                output_path = run_effect(request["effect"], request["input_path"],
+                                         request["output_path"], request.get("args", []))
+                reply({"id": job_id, "ok": True, "output_path": output_path})
+            except Exception as e:
+                traceback.print_exc()
+                reply({"id": job_id, "ok": False, "error": str(e)})
+
+        else:
+            reply({"id": job_id, "ok": False, "error": f"Unknown command: {command}"})
+
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        serve()
+        return
+
     if len(sys.argv) < 4:
         print("Usage: run_effect_subprocess.py <effect> <input_path> <output_path> [args...]")
+        print("       run_effect_subprocess.py --serve")
         sys.exit(1)
 
     effect = sys.argv[1]
@@ -103,32 +228,12 @@ def main():
     print(f"[Subprocess] Output Path: {output_path}")
     print(f"[Subprocess] Extra Args: {args}\n")
 
-    # Detect --normal flag and remove it from args
-    is_normal_flag = False
-    if "--normal" in args:
-        is_normal_flag = True
-        args.remove("--normal")
+    if effect not in EFFECT_HANDLERS:
+        print(f"[ERROR] Unknown effect: {effect}")
+        sys.exit(1)
 
     try:
-        if effect == "pixelate":
-            result = run_pixelate([input_path] + args)
-        elif effect == "brush":
-            result = run_brush([input_path] + args)
-        elif effect == "voronoi":
-            result = run_voronoi([input_path] + args)
-        elif effect == "brushstyle":
-            result = run_brushstyle([input_path] + args)
-        elif effect == "slicstylize":
-            result = run_slicstylize([input_path] + args)
-        else:
-            print(f"[ERROR] Unknown effect: {effect}")
-            sys.exit(1)
-
-        # Post-process if it's a normal map (skip for pixelate)
-        result = apply_optional_normal_mask(result, input_path, is_normal_flag, effect)
-
-        save_image(result, output_path)
-        print(f"[Subprocess] Image saved to {output_path}")
+        run_effect(effect, input_path, output_path, args)
 
     except Exception as e:
         print(f"[ERROR] Failed to apply effect: {e}")
@@ -0,0 +1,60 @@
+"""
+Paint Transformer renderers on the odd and rectangular patch grids of a pyramid
+padded to the patch grid.
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PedroVerse.neural_paint_transformer.inference import (
+    PATCH_SIZE, STROKE_NUM, make_meta_brushes, param2img_parallel, param2img_serial)
+
+# (rows, cols) of the patch grid
+GRIDS = [(1, 1), (2, 2), (4, 4), (3, 3), (3, 5), (5, 2), (4, 3), (2, 7), (7, 1)]
+
+
+def random_brushes(seed, size=64):
+    rng = np.random.default_rng(seed)
+    vertical = np.zeros((size, size), dtype=np.uint8)
+    vertical[:, size // 4:3 * size // 4] = 255
+    noise = rng.integers(0, 64, size=(size, size), dtype=np.uint8)
+    return np.maximum(vertical, noise), np.maximum(vertical.T, noise)
+
+
+def random_strokes(seed, rows, cols):
+    generator = torch.Generator().manual_seed(seed)
+    param = torch.rand(1, rows, cols, STROKE_NUM, 8, generator=generator)
+    decision = torch.rand(1, rows, cols, STROKE_NUM, generator=generator) > 0.3
+    canvas = torch.rand(1, 3, rows * PATCH_SIZE // 2, cols * PATCH_SIZE // 2, generator=generator)
+    return param, decision, canvas
+
+
+@pytest.mark.parametrize("rows, cols", GRIDS)
+def test_parallel_without_strokes_keeps_canvas(rows, cols):
+    meta_brushes = make_meta_brushes(*random_brushes(0), torch.device("cpu"))
+    param, decision, canvas = random_strokes(rows * 10 + cols, rows, cols)
+    decision[:] = False
+
+    with torch.no_grad():
+        # the unbudgeted path cannot render an empty set of strokes
+        result = param2img_parallel(param, decision, meta_brushes, canvas.clone(), memory_budget=1 << 30)
+
+    assert torch.equal(result, canvas)
+
+
+@pytest.mark.parametrize("rows, cols", GRIDS)
+def test_serial_matches_parallel(rows, cols):
+    meta_brushes = make_meta_brushes(*random_brushes(rows * 10 + cols), torch.device("cpu"))
+    param, decision, canvas = random_strokes(rows * 10 + cols, rows, cols)
+
+    with torch.no_grad():
+        parallel = param2img_parallel(param, decision, meta_brushes, canvas.clone())
+        serial = param2img_serial(param, decision, meta_brushes, canvas.clone(), None)
+
+    assert serial.shape == parallel.shape == canvas.shape
+    torch.testing.assert_close(serial, parallel, rtol=0, atol=1e-6)
@@ -0,0 +1,94 @@
+"""
+painterlybrush.makeSplineStrokes traces every stroke of a layer at once; it must
+give the same strokes as tracing each seed on its own with the original
+per-stroke loop (make_spline_stroke below).
+"""
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PedroVerse.painterlybrush import painterlybrush, BLANK_CANVAS, IMPRESSIONIST, EXPRESSIONIST
+
+
+def color_diff(color1, color2):
+    r_diff = float(color1[0]) - float(color2[0])
+    g_diff = float(color1[1]) - float(color2[1])
+    b_diff = float(color1[2]) - float(color2[2])
+    return np.sqrt(r_diff**2 + g_diff**2 + b_diff**2)
+
+
+def make_spline_stroke(brush, x0, y0, R, refImg):
+    numRow, numCol, numCh = brush.canvas.shape
+    strokeColor = refImg[x0, y0]
+    K = [(x0, y0)]
+    x, y = x0, y0
+    lastDx, lastDy = 0, 0
+
+    for i in range(0, brush.maxl + 1):
+        # the blank canvas used to hold BLANK_CANVAS in every channel
+        canvasColor = (BLANK_CANVAS,) * 3 if brush.blank else brush.canvas[x, y]
+        if (i > brush.minl) and (color_diff(refImg[x, y], canvasColor) < color_diff(refImg[x, y], strokeColor)):
+            return K
+
+        # detect vanishing gradient
+        if brush.gradientMag[x, y] == 0:
+            return K
+
+        gy, gx = brush.sobelx[x, y], brush.sobely[x, y]
+        dx, dy = -gy, gx
+        if lastDx * dx + lastDy * dy < 0:
+            dx, dy = -dx, -dy
+
+        dx = brush.fc * dx + (1 - brush.fc) * lastDx
+        dy = brush.fc * dy + (1 - brush.fc) * lastDy
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dx = dx / np.sqrt(dx**2 + dy**2)
+            dy = dy / np.sqrt(dx**2 + dy**2)
+        # a direction that filters out to zero ends the stroke (int(nan) raised before)
+        if not (np.isfinite(dx) and np.isfinite(dy)):
+            return K
+
+        x, y = (int(x + R*dx), int(y + R*dy))
+        if (x >= numRow) or (y >= numCol):
+            return K
+        lastDx, lastDy = dx, dy
+        K.append((x, y))
+
+    return K
+
+
+def source_image(seed, shape=(192, 160, 3)):
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(0, 256, size=(shape[0] // 8, shape[1] // 8, 3), dtype=np.uint8)
+    image = cv2.resize(noise, (shape[1], shape[0]), interpolation=cv2.INTER_CUBIC)
+    # flat patches give strokes that stop on a vanishing gradient
+    image[:16, :16] = 128
+    return image
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("style", [IMPRESSIONIST, EXPRESSIONIST], ids=["impressionist", "expressionist"])
+def test_batched_strokes_match_per_stroke_tracing(seed, style):
+    brush = painterlybrush()
+    batched = brush.makeSplineStrokes
+    checked = []
+
+    def checking_make_spline_strokes(x0, y0, R, refImg):
+        strokeX, strokeY, strokeLength = batched(x0, y0, R, refImg)
+        for k in range(len(x0)):
+            expected = make_spline_stroke(brush, int(x0[k]), int(y0[k]), R, refImg)
+            actual = list(zip(strokeX[k, :strokeLength[k]].tolist(), strokeY[k, :strokeLength[k]].tolist()))
+            assert actual == expected, f"stroke {k} of layer R={R}"
+        checked.append(len(x0))
+        return strokeX, strokeY, strokeLength
+
+    brush.makeSplineStrokes = checking_make_spline_strokes
+    brush.paint(source_image(seed), *style, seed=seed)
+
+    assert len(checked) == len(style[1]) and sum(checked) > 0
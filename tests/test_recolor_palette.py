@@ -0,0 +1,38 @@
+"""
+palette.simple_bins_array bins pixels with numpy; it must give the same bins,
+in the same order, as simple_bins over image.getcolors.
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "recolor"))
+
+from palette import simple_bins, simple_bins_array
+
+SEEDS = range(3)
+
+
+def random_lab_image(seed, size=(61, 47)):
+    rng = np.random.default_rng(seed)
+    # few distinct colours, so colours repeat and bins hold several of them
+    colors = rng.integers(0, 256, size=(300, 3), dtype=np.uint8)
+    pixels = colors[rng.integers(0, len(colors), size=size[0] * size[1])]
+    return Image.frombytes('LAB', size, pixels.tobytes())
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("chunk", [1 << 22, 100])
+def test_simple_bins_array(seed, chunk):
+    image = random_lab_image(seed)
+    bins = {}
+    for count, color in image.getcolors(image.width * image.height):
+        bins[color] = count
+    expected = simple_bins(bins)
+
+    colors, counts = simple_bins_array(image, chunk=chunk)
+    assert [tuple(color) for color in colors.tolist()] == list(expected.keys())
+    assert counts.tolist() == list(expected.values())
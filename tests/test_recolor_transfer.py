@@ -0,0 +1,86 @@
+"""
+The ndarray image_transfer in recolor/transfer.py must give exactly the image
+the original per-colour implementation gave (reference_image_transfer below):
+its LUT is truncated to bytes, so weights that are off by one rounding step
+already change pixels.
+"""
+import itertools
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "recolor"))
+
+from util import ByteLAB, RegularLAB, rgb2lab
+from transfer import (PaletteWeights, RGB_sample_color, calc_weights, image_transfer, luminance_transfer,
+                      multiple_color_transfer, nearest_color, trilinear_interpolation)
+
+SEEDS = range(3)
+
+
+def reference_image_transfer(image, original_p, modified_p, sample_level=16, luminance_flag=False):
+    original_p = [RegularLAB(c) for c in original_p]
+    modified_p = [RegularLAB(c) for c in modified_p]
+    level = 255 / (sample_level - 1)
+    levels = [i * (255/(sample_level-1)) for i in range(sample_level)]
+
+    sample_color_map = {}
+    for color in RGB_sample_color(sample_level):
+        lab = multiple_color_transfer(RegularLAB(color), original_p, modified_p)
+        if luminance_flag:
+            lab = (luminance_transfer(RegularLAB(color), original_p, modified_p), *lab[-2:])
+        sample_color_map[color] = ByteLAB(lab)
+
+    color_map = {}
+    for _, color in image.getcolors(image.width * image.height):
+        result = trilinear_interpolation(color, nearest_color(color, level, levels), sample_color_map)
+        color_map[color] = tuple([int(x) for x in result])
+
+    result = Image.new('LAB', image.size)
+    result_pixels = result.load()
+    image_pixels = image.load()
+    for i in range(image.width):
+        for j in range(image.height):
+            result_pixels[i, j] = color_map[image_pixels[i, j]]
+    return result
+
+
+def random_palettes(seed, k=5):
+    rng = np.random.default_rng(seed)
+    original_p = [tuple(c) for c in rng.integers(0, 256, size=(k, 3)).tolist()]
+    modified_p = [tuple(c) for c in rng.integers(0, 256, size=(k, 3)).tolist()]
+    # palettes come sorted by luminance, which luminance_transfer relies on
+    return sorted(original_p, reverse=True), sorted(modified_p, reverse=True)
+
+
+def before_image(seed, size=(48, 40)):
+    image = Image.open(os.path.join(ROOT, "images", "before.png")).convert('RGB')
+    rng = np.random.default_rng(seed)
+    left = int(rng.integers(0, image.width - size[0]))
+    top = int(rng.integers(0, image.height - size[1]))
+    return rgb2lab(image.crop((left, top, left + size[0], top + size[1])))
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_palette_weights_match_calc_weights(seed):
+    original_p = [RegularLAB(c) for c in random_palettes(seed)[0]]
+    levels = [i * (255/15) for i in range(16)]
+    colors = [RegularLAB(color) for color in itertools.product(levels, repeat=3)]
+
+    expected = np.array([calc_weights(color, original_p) for color in colors])
+    np.testing.assert_array_equal(PaletteWeights(original_p)(colors), expected)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("luminance_flag", [False, True])
+def test_image_transfer_matches_reference(seed, luminance_flag):
+    image = before_image(seed)
+    original_p, modified_p = random_palettes(seed)
+
+    result = image_transfer(image, original_p, modified_p, sample_level=8, luminance_flag=luminance_flag)
+    expected = reference_image_transfer(image, original_p, modified_p, sample_level=8, luminance_flag=luminance_flag)
+    assert result.tobytes() == expected.tobytes()
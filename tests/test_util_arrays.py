@@ -0,0 +1,202 @@
+"""
+The ndarray colour conversions in recolor/util.py must agree with the scalar
+ones they replace: byte mappings exactly, float conversions up to rounding.
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "recolor"))
+
+from util import (RGBtoXYZ, XYZtoLAB, RGBtoLAB, LABtoXYZ, XYZtoRGB, LABtoRGB, ValidLAB, ValidRGB,
+                  RegularLAB, ByteLAB, RegularRGB,
+                  RGBtoXYZ_array, XYZtoLAB_array, RGBtoLAB_array, LABtoXYZ_array, XYZtoRGB_array,
+                  LABtoRGB_array, ValidLAB_array, ValidRGB_array, RegularLAB_array, ByteLAB_array,
+                  RegularRGB_array, rgb2lab_slow, lab2rgb_slow)
+
+SEEDS = range(5)
+
+# Channel values around the branch points of the conversions: 0/255, the sRGB
+# linear segment (0.04045 * 255 = 10.3) and the byte LAB midpoint.
+EDGE_BYTES = [0, 1, 10, 11, 127, 128, 129, 254, 255]
+
+
+def edge_triples():
+    values = np.array(EDGE_BYTES)
+    return np.stack(np.meshgrid(values, values, values, indexing="ij"), axis=-1).reshape(-1, 3)
+
+
+def byte_triples(seed, n=2000):
+    rng = np.random.default_rng(seed)
+    return np.concatenate([rng.integers(0, 256, size=(n, 3)), edge_triples()])
+
+
+def around(*values):
+    """The values and their neighbouring floats on either side."""
+    values = np.array(values, dtype=np.float64)
+    return np.concatenate([values, np.nextafter(values, -np.inf), np.nextafter(values, np.inf)])
+
+
+def channel_grid(*channels):
+    return np.stack(np.meshgrid(*channels, indexing="ij"), axis=-1).reshape(-1, 3)
+
+
+def lab_triples(seed, n=2000):
+    """
+    Valid LAB colours; most of the LAB box is outside the sRGB gamut, so many
+    convert to negative XYZ or to RGB outside 0..255. The grid covers the box
+    corners and the points where f in LABtoXYZ switches branches (t = 6/29).
+    """
+    rng = np.random.default_rng(seed)
+    random = np.stack([rng.uniform(0, 100, n), rng.uniform(-128, 127, n), rng.uniform(-128, 127, n)], axis=-1)
+    # L = 116 * 6/29 - 16 = 8 is the Y branch point
+    grid = channel_grid([0, 8, 50, 100], [-128, 0, 127], [-128, 0, 127])
+    return np.concatenate([random, grid])
+
+
+def scalar_map(function, triples):
+    return np.array([function(tuple(float(v) for v in triple)) for triple in triples])
+
+
+def rgb2lab_pixels(image):
+    result = Image.new('LAB', image.size)
+    result_pixels = result.load()
+    for i in range(image.width):
+        for j in range(image.height):
+            result_pixels[i, j] = ByteLAB(RGBtoLAB(image.getpixel((i, j))[:3]))
+    return result
+
+
+def lab2rgb_pixels(image):
+    result = Image.new('RGB', image.size)
+    result_pixels = result.load()
+    for i in range(image.width):
+        for j in range(image.height):
+            result_pixels[i, j] = RegularRGB(LABtoRGB(RegularLAB(image.getpixel((i, j)))))
+    return result
+
+
+def random_image(seed, mode, size=(37, 23)):
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8)
+    edges = edge_triples().astype(np.uint8)
+    pixels.reshape(-1, 3)[:len(edges)] = edges
+    return Image.frombytes(mode, size, pixels.tobytes())
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_rgb_to_xyz(seed):
+    rgb = byte_triples(seed)
+    np.testing.assert_allclose(RGBtoXYZ_array(rgb), scalar_map(RGBtoXYZ, rgb), rtol=1e-12, atol=1e-12)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_xyz_to_lab(seed):
+    rng = np.random.default_rng(seed)
+    # (6/29)^3 scaled by the white point is where XYZtoLAB switches branches.
+    threshold = (6/29)**3 * np.array([95.047, 100.000, 108.883])
+    xyz = np.concatenate([rng.uniform(0, 110, size=(2000, 3)), np.zeros((1, 3)),
+                          threshold[None], np.nextafter(threshold, 0)[None], np.nextafter(threshold, 1)[None]])
+    np.testing.assert_allclose(XYZtoLAB_array(xyz), scalar_map(XYZtoLAB, xyz), rtol=1e-12, atol=1e-12)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_rgb_to_lab(seed):
+    rgb = byte_triples(seed)
+    np.testing.assert_allclose(RGBtoLAB_array(rgb), scalar_map(RGBtoLAB, rgb), rtol=1e-12, atol=1e-12)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_lab_to_xyz(seed):
+    lab = lab_triples(seed)
+    # a and b where (L+16)/116 + a/500 and (L+16)/116 - b/200 sit at 6/29, for L = 20
+    t = 36/116
+    branch = np.concatenate([channel_grid([20], around(500 * (6/29 - t)), around(200 * (t - 6/29))),
+                             channel_grid(around(8), [0], [0])])
+    lab = np.concatenate([lab, branch])
+    np.testing.assert_allclose(LABtoXYZ_array(lab), scalar_map(LABtoXYZ, lab), rtol=1e-12, atol=1e-12)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_xyz_to_rgb(seed):
+    rng = np.random.default_rng(seed)
+    # negative and far out of range XYZ, as out-of-gamut LAB colours give
+    xyz = np.concatenate([rng.uniform(-50, 200, size=(2000, 3)), rng.uniform(0, 110, size=(2000, 3)),
+                          np.zeros((1, 3)), [[-1e-9, 0, 1e-9], [95.047, 100.000, 108.883]]])
+    # X alone sets R = f(3.2406 * X / 100): put R at the 0.0031308 branch point
+    threshold = around(0.0031308 / 3.2406 * 100)
+    xyz = np.concatenate([xyz, np.stack([threshold, np.zeros_like(threshold), np.zeros_like(threshold)], axis=-1)])
+    np.testing.assert_allclose(XYZtoRGB_array(xyz), scalar_map(XYZtoRGB, xyz), rtol=1e-12, atol=1e-12)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_lab_to_rgb(seed):
+    lab = lab_triples(seed)
+    rgb = LABtoRGB_array(lab)
+    np.testing.assert_allclose(rgb, scalar_map(LABtoRGB, lab), rtol=1e-12, atol=1e-12)
+    assert not ValidRGB_array(rgb).all() and ValidRGB_array(rgb).any()
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_valid_lab(seed):
+    rng = np.random.default_rng(seed)
+    lab = np.concatenate([
+        np.stack([rng.uniform(-20, 120, 2000), rng.uniform(-150, 150, 2000), rng.uniform(-150, 150, 2000)], axis=-1),
+        channel_grid(around(0, 100), around(-128, 127), around(-128, 127)),
+    ])
+    expected = np.array([ValidLAB(tuple(triple)) for triple in lab.tolist()])
+    np.testing.assert_array_equal(ValidLAB_array(lab), expected)
+    assert expected.any() and not expected.all()
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_valid_rgb(seed):
+    rng = np.random.default_rng(seed)
+    edges = around(0, 255)
+    rgb = np.concatenate([rng.uniform(-50, 300, size=(2000, 3)), channel_grid(edges, edges, edges),
+                          byte_triples(seed)])
+    expected = np.array([ValidRGB(tuple(triple)) for triple in rgb.tolist()])
+    np.testing.assert_array_equal(ValidRGB_array(rgb), expected)
+    assert expected.any() and not expected.all()
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_regular_lab(seed):
+    lab = byte_triples(seed)
+    np.testing.assert_array_equal(RegularLAB_array(lab), scalar_map(RegularLAB, lab))
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_byte_lab(seed):
+    rng = np.random.default_rng(seed)
+    lab = np.concatenate([
+        np.stack([rng.uniform(0, 100, 2000), rng.uniform(-128, 127, 2000), rng.uniform(-128, 127, 2000)], axis=-1),
+        RegularLAB_array(edge_triples()),
+        [[0, -128, -128], [100, 127, 127], [50.0000001, -0.5, 0.5]],
+    ])
+    expected = np.array([ByteLAB(tuple(triple)) for triple in lab.tolist()])
+    np.testing.assert_array_equal(ByteLAB_array(lab), expected)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_regular_rgb(seed):
+    rng = np.random.default_rng(seed)
+    rgb = np.concatenate([rng.uniform(-50, 300, size=(2000, 3)),
+                          [[-0.5, 0.5, 254.9999], [255, 255.5, 256], [-1e-9, 0, 1e-9]]])
+    expected = np.array([RegularRGB(tuple(triple)) for triple in rgb.tolist()])
+    np.testing.assert_array_equal(RegularRGB_array(rgb), expected)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_rgb2lab_slow(seed):
+    image = random_image(seed, 'RGB')
+    assert rgb2lab_slow(image).tobytes() == rgb2lab_pixels(image).tobytes()
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_lab2rgb_slow(seed):
+    image = random_image(seed, 'LAB')
+    assert lab2rgb_slow(image).tobytes() == lab2rgb_pixels(image).tobytes()
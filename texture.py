@@ -4,7 +4,7 @@ import sys
 import numpy as np
 import uuid
 from . import globals
-import subprocess
+from .effect_worker import get_worker, EffectWorkerError
 
 
 os.environ['TFHUB_MODEL_LOAD_FORMAT'] = 'COMPRESSED'
@@ -96,25 +96,22 @@ class TEXTURE_OT_LoadImage(bpy.types.Operator):
                 tex_image.image = temp_tex_image
 
 
-            python_file = "/texture_subprocess.py"
-
             output_path = bpy.path.abspath(f"//output_{uuid.uuid4().hex}.png")
 
-            args = [
-                globals.PYTHON, dir_path+python_file,
-                bpy.path.abspath(tex_image.image.filepath),
+            # Runs on the persistent effect worker, which keeps the TFLite
+            # interpreters allocated between runs.
+            effect_args = [
                 str(bpy.context.scene.blending_ratio),
                 str(content_image_size),
                 dir_path + "/style_predict.tflite",
                 dir_path + "/style_transform.tflite",
                 self.filepath,
-                output_path
             ]
 
-            result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            print("\n\n" + result.stderr)
-            if result.stdout == "":
-                self.report({'ERROR'}, "Style Transfer Failed")
+            try:
+                get_worker().run("texture", bpy.path.abspath(tex_image.image.filepath), output_path, effect_args)
+            except EffectWorkerError as e:
+                self.report({'ERROR'}, f"Style Transfer Failed: {e}")
                 return {'CANCELLED'}
             
             ou_img = bpy.data.images.load(output_path, check_existing=True)
@@ -2,42 +2,69 @@ import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'  
 import warnings
 warnings.filterwarnings('ignore', category=UserWarning)
-import tensorflow as tf
 import numpy as np
 import sys
+import hashlib
 from PIL import Image
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Uses tflite_runtime when installed; full TensorFlow is only imported as a fallback.
+from PedroVerse.tflite_backend import make_interpreter, load_image, preprocess_image
+from PedroVerse.disk_cache import evict, touch
+
+# Style bottlenecks only depend on the image and the predict model, so they are
+# kept on disk and reused when the user only changes the blending ratio. A
+# bottleneck is well under 1 KB; past MAX_CACHE_BYTES the least recently used
+# ones are deleted.
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bottleneck_cache")
+MAX_CACHE_BYTES = 16 << 20
+
+# (model path, content size) -> allocated interpreter. Kept for the life of the
+# process, i.e. across jobs when style transfer runs on the effect worker.
+_interpreters = {}
+
+
+def get_interpreter(model_path, content_image_size=None):
+  key = (os.path.abspath(model_path), content_image_size)
+  if key in _interpreters:
+    return _interpreters[key]
+
+  interpreter = make_interpreter(model_path)
+  if content_image_size is not None:
+    input_details = interpreter.get_input_details()
+    for index in range(len(input_details)):
+      if input_details[index]["name"]=='content_image':
+        index = input_details[index]["index"]
+        interpreter.resize_tensor_input(index, [1, content_image_size, content_image_size, 3])
+  interpreter.allocate_tensors()
+
+  _interpreters[key] = interpreter
+  return interpreter
 
 def run_style_predict(preprocessed_style_image, style_predict_path):
   # Load the model.
-  interpreter = tf.lite.Interpreter(model_path=style_predict_path)
+  interpreter = get_interpreter(style_predict_path)
 
   # Set model input.
-  interpreter.allocate_tensors()
   input_details = interpreter.get_input_details()
   interpreter.set_tensor(input_details[0]["index"], preprocessed_style_image)
 
   # Calculate style bottleneck.
+  # get_tensor copies, so the result survives the next invoke on the shared interpreter.
   interpreter.invoke()
-  style_bottleneck = interpreter.tensor(
+  style_bottleneck = interpreter.get_tensor(
       interpreter.get_output_details()[0]["index"]
-      )()
+      )
 
   return style_bottleneck
 
 def run_style_transform(style_bottleneck, preprocessed_content_image, content_image_size, style_transform_path):
   # Load the model.
-  interpreter = tf.lite.Interpreter(model_path=style_transform_path)
-
-  # Set model input.
-  input_details = interpreter.get_input_details()
-  for index in range(len(input_details)):
-    if input_details[index]["name"]=='content_image':
-      index = input_details[index]["index"]
-      interpreter.resize_tensor_input(index, [1, content_image_size, content_image_size, 3])
-  interpreter.allocate_tensors()
+  interpreter = get_interpreter(style_transform_path, content_image_size)
 
   # Set model inputs.
+  input_details = interpreter.get_input_details()
   for index in range(len(input_details)):
     if input_details[index]["name"]=='Conv/BiasAdd':
       interpreter.set_tensor(input_details[index]["index"], style_bottleneck)
@@ -46,12 +73,50 @@ def run_style_transform(style_bottleneck, preprocessed_content_image, content_im
   interpreter.invoke()
 
   # Transform content image.
-  stylized_image = interpreter.tensor(
+  stylized_image = interpreter.get_tensor(
       interpreter.get_output_details()[0]["index"]
-      )()
+      )
 
   return stylized_image
 
+def bottleneck_cache_key(img_path, style_predict_path):
+  digest = hashlib.sha1()
+  with open(img_path, "rb") as f:
+    for chunk in iter(lambda: f.read(1 << 20), b""):
+      digest.update(chunk)
+  model_stat = os.stat(style_predict_path)
+  digest.update(f"{os.path.abspath(style_predict_path)}:{model_stat.st_size}:{model_stat.st_mtime_ns}".encode())
+  return digest.hexdigest()
+
+def cached_style_bottleneck(img_path, style_predict_path, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+  """
+  Returns the style bottleneck of the image at img_path, loading it from the
+  on-disk cache (keyed by image content hash and predict model) when possible.
+  """
+  cache_path = os.path.join(cache_dir, bottleneck_cache_key(img_path, style_predict_path) + ".npy")
+  if os.path.exists(cache_path):
+    try:
+      style_bottleneck = np.load(cache_path)
+      touch(cache_path)
+      return style_bottleneck
+    except (OSError, ValueError):
+      pass
+
+  style_img = preprocess_image(load_image(img_path), 256)
+  style_bottleneck = run_style_predict(style_img, style_predict_path)
+
+  try:
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+      np.save(f, style_bottleneck)
+    os.replace(tmp_path, cache_path)
+    evict(cache_dir, max_bytes, keep=cache_path)
+  except OSError:
+    pass
+
+  return style_bottleneck
+
 def tensor_to_image(tensor):
     tensor = tensor*255
     tensor = np.array(tensor, dtype=np.uint8)
@@ -60,44 +125,21 @@ def tensor_to_image(tensor):
         tensor = tensor[0]
     return tensor
 
-def load_img(path_to_img):
-  img = tf.io.read_file(path_to_img)
-  img = tf.io.decode_image(img, channels=3)
-  img = tf.image.convert_image_dtype(img, tf.float32)
-  img = img[tf.newaxis, :]
-
-  return img
-
-def preprocess_image(image, target_dim):
-  # Resize the image so that the shorter dimension becomes 256px.
-  shape = tf.cast(tf.shape(image)[1:-1], tf.float32)
-  short_dim = min(shape)
-  scale = target_dim / short_dim
-  new_shape = tf.cast(shape * scale, tf.int32)
-  image = tf.image.resize(image, new_shape)
-
-  # Central crop the image.
-  image = tf.image.resize_with_crop_or_pad(image, target_dim, target_dim)
-
-  return image
-
-def texture(content_img_path, blending_ratio, content_image_size, style_predict_path, style_transform_path, style_img_path, output_path):
-    content_img = load_img(content_img_path)
-    
-    style_img = load_img(style_img_path)
-                
-    prev = preprocess_image(content_img, 256)
+def stylize(content_img_path, blending_ratio, content_image_size, style_predict_path, style_transform_path, style_img_path):
+    """Returns the content image restyled after style_img_path as an RGB uint8 array."""
+    content_img = load_image(content_img_path)
     content_img = preprocess_image(content_img, content_image_size)
-    style_img = preprocess_image(style_img, 256)
-    
-    style_bottleneck_content = run_style_predict(
-        prev, style_predict_path
-    )
-    style_bottleneck = run_style_predict(tf.constant(style_img), style_predict_path)
+
+    style_bottleneck_content = cached_style_bottleneck(content_img_path, style_predict_path)
+    style_bottleneck = cached_style_bottleneck(style_img_path, style_predict_path)
     style_bottleneck_blended = (blending_ratio/100.0) * style_bottleneck_content \
                     + (1 - (blending_ratio/100.0)) * style_bottleneck
     stylized_img = run_style_transform(style_bottleneck_blended, content_img, content_image_size, style_transform_path)
-    stylized_img = tensor_to_image(stylized_img)
+    return tensor_to_image(stylized_img)
+
+def texture(content_img_path, blending_ratio, content_image_size, style_predict_path, style_transform_path, style_img_path, output_path):
+    stylized_img = stylize(content_img_path, blending_ratio, content_image_size,
+                           style_predict_path, style_transform_path, style_img_path)
     Image.fromarray(stylized_img).save(output_path)
 
     print(output_path)